@@ -0,0 +1,4 @@
+CREATE TABLE `banned_player` (
+  `user_id` VARCHAR(8) NOT NULL,
+  `detected_at` DATETIME NOT NULL,
+  PRIMARY KEY (`user_id`));
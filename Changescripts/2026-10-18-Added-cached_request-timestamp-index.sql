@@ -0,0 +1,2 @@
+ALTER TABLE `cached_request`
+ADD INDEX `cached_request_timestamp_index` (`timestamp` ASC);
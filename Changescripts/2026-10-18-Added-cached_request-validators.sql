@@ -0,0 +1,4 @@
+ALTER TABLE `cached_request`
+  ADD COLUMN `etag` VARCHAR(255) NULL AFTER `result`,
+  ADD COLUMN `last_modified` VARCHAR(64) NULL AFTER `etag`,
+  ADD COLUMN `body_hash` CHAR(40) NULL AFTER `last_modified`; -- SHA-1 of `result`
@@ -0,0 +1,4 @@
+CREATE TABLE `circuit_breaker` (
+  `name` VARCHAR(32) NOT NULL,
+  `open_until` DATETIME NOT NULL,
+  PRIMARY KEY (`name`));
@@ -0,0 +1,19 @@
+ALTER TABLE `game_values`
+ADD COLUMN `wr_points_per_hour` INT NOT NULL DEFAULT 0 AFTER `mean_time`;
+
+UPDATE `game_values`
+SET `wr_points_per_hour` = (`wr_points` * 3600) DIV GREATEST(`wr_time`, 1);
+
+-- One index per sortable column, with and without the platform filter.
+-- The primary key columns come last to resolve ties and to seek to the keyset pagination cursor.
+ALTER TABLE `game_values`
+ADD INDEX `game_values_wr_points_index` (`wr_points`, `game_id`, `category_id`),
+ADD INDEX `game_values_wr_time_index` (`wr_time`, `game_id`, `category_id`),
+ADD INDEX `game_values_wr_points_per_hour_index` (`wr_points_per_hour`, `game_id`, `category_id`),
+ADD INDEX `game_values_platform_wr_points_index` (`platform_id`, `wr_points`, `game_id`, `category_id`),
+ADD INDEX `game_values_platform_wr_time_index` (`platform_id`, `wr_time`, `game_id`, `category_id`),
+ADD INDEX `game_values_platform_wr_points_per_hour_index` (`platform_id`, `wr_points_per_hour`, `game_id`, `category_id`);
+
+-- The game / category search matches either, game values are already found by game through the primary key
+ALTER TABLE `game_values`
+ADD INDEX `game_values_category_index` (`category_id`);
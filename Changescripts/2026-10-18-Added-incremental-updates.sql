@@ -0,0 +1,2 @@
+ALTER TABLE `player`
+  ADD COLUMN `last_full_update` DATETIME NULL AFTER `last_update`;
@@ -0,0 +1,7 @@
+CREATE TABLE `payload_version` (
+  `name` VARCHAR(32) NOT NULL,
+  `version` INT NOT NULL,
+  PRIMARY KEY (`name`));
+
+INSERT INTO `payload_version` (`name`, `version`)
+VALUES ('players', 1), ('game-values', 1);
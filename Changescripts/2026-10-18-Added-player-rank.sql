@@ -0,0 +1,15 @@
+ALTER TABLE `player`
+ADD COLUMN `rank` INT NULL AFTER `last_update`,
+ADD INDEX `player_rank_index` (`rank` ASC),
+ADD INDEX `player_score_index` (`score` ASC);
+
+UPDATE `player` p JOIN (
+  SELECT user_id,
+    IF(score = @_last_score, @cur_rank := @cur_rank, @cur_rank := @_sequence) AS new_rank,
+    @_sequence := @_sequence + 1,
+    @_last_score := score
+  FROM `player`, (SELECT @cur_rank := 1, @_sequence := 1, @_last_score := NULL) r
+  WHERE score > 0
+  ORDER BY score DESC
+) ranked ON ranked.user_id = p.user_id
+SET p.`rank` = ranked.new_rank;
@@ -0,0 +1,25 @@
+CREATE TABLE `player_run_score` (
+  `player_id` VARCHAR(8) NOT NULL,
+  `run_id` VARCHAR(8) NOT NULL,
+  `game_id` VARCHAR(8) NOT NULL,
+  `game_name` VARCHAR(128) NOT NULL,
+  `category_id` VARCHAR(8) NOT NULL,
+  `category_name` VARCHAR(128) NOT NULL,
+  `level_id` VARCHAR(8) NOT NULL,
+  `level_name` VARCHAR(128) NOT NULL,
+  `variables` VARCHAR(1024) NOT NULL DEFAULT '{}',
+  `platform_id` VARCHAR(8) NULL,
+  `primary_t` DOUBLE NOT NULL DEFAULT 0,
+  `points` DOUBLE NOT NULL,
+  `level_fraction` DOUBLE NOT NULL,
+  `is_counted` TINYINT(1) NOT NULL DEFAULT 1,
+  `is_top_run` TINYINT(1) NOT NULL,
+  `position` INT NOT NULL,
+  PRIMARY KEY (`player_id`, `run_id`),
+  INDEX `player_run_score_player_position_index` (`player_id`, `is_counted`, `is_top_run`, `position`),
+  INDEX `player_run_score_game_points_index` (`game_id`, `category_id`, `points`),
+  CONSTRAINT `player_run_score_player_id_fk`
+    FOREIGN KEY (`player_id`)
+    REFERENCES `player` (`user_id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE);
@@ -0,0 +1,12 @@
+CREATE TABLE `update_job` (
+  `job_id` VARCHAR(36) NOT NULL,
+  `name_or_id` VARCHAR(64) NOT NULL,
+  `status` VARCHAR(8) NOT NULL,
+  `progress_done` INT NOT NULL DEFAULT 0,
+  `progress_total` INT NULL,
+  `status_code` INT NULL,
+  `result` LONGTEXT NULL,
+  `created_at` DATETIME NOT NULL,
+  `updated_at` DATETIME NOT NULL,
+  PRIMARY KEY (`job_id`),
+  INDEX `update_job_updated_at_index` (`updated_at` ASC));
@@ -2,13 +2,93 @@
 Provides the API endpoints for consuming and producing REST requests and
 responses within the Game Search context
 """
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
+from models.core_models import PayloadVersion
 from models.game_search_models import GameValues
+from services.payload_cache import get_cached_payload_response
 from services.utils import map_to_dto
+from typing import Optional, Tuple
+import base64
+import binascii
+import json
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 api = Blueprint('game_search_api', __name__)
 
 
 @api.route('/game-values', methods=('GET',))
 def get_all_game_values():
-    return jsonify(map_to_dto(GameValues.query.all()))
+    """
+    Without any query parameter, returns every game value. Otherwise returns a single page:
+    `{ "data": [...], "next": cursor or null }`
+
+    Query parameters (all optional):
+    - platform: Can be repeated
+    - game, category: Can be repeated. Matches the game values of any of those games or of any of those categories
+    - minWrTime, maxWrTime, minMeanTime, maxMeanTime: In seconds, inclusive
+    - minWrPoints, maxWrPoints: Inclusive
+    - orderBy: wrPoints (default), wrTime or wrPointsPerHour
+    - order: desc (default) or asc
+    - limit: Page size, up to MAX_PAGE_SIZE
+    - after: The "next" cursor of the previous page
+    """
+    if not request.args:
+        return get_cached_payload_response(PayloadVersion.GAME_VALUES, lambda: map_to_dto(GameValues.query.all()))
+
+    try:
+        order_by = request.args.get('orderBy', 'wrPoints')
+        if order_by not in GameValues.SORTABLE_COLUMNS:
+            raise ValueError(f"orderBy must be one of: {', '.join(GameValues.SORTABLE_COLUMNS)}")
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be either asc or desc")
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        game_values = GameValues.search(
+            request.args.getlist('platform'),
+            request.args.getlist('game'),
+            request.args.getlist('category'),
+            (__get_int_arg('minWrTime'), __get_int_arg('maxWrTime')),
+            (__get_int_arg('minMeanTime'), __get_int_arg('maxMeanTime')),
+            (__get_int_arg('minWrPoints'), __get_int_arg('maxWrPoints')),
+            order_by,
+            order == 'desc',
+            limit,
+            __decode_cursor(request.args.get('after')))
+    except ValueError as exception:
+        return jsonify({'message': str(exception)}), 400
+
+    last_game_value = game_values[-1] if len(game_values) == limit else None
+    return jsonify({
+        'data': map_to_dto(game_values),
+        'next': __encode_cursor(last_game_value, order_by) if last_game_value else None,
+    })
+
+
+def __get_int_arg(name: str) -> Optional[int]:
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+
+def __encode_cursor(game_value: GameValues, order_by: str) -> str:
+    sorted_value = getattr(game_value, GameValues.SORTABLE_COLUMNS[order_by])
+    return base64.urlsafe_b64encode(
+        json.dumps([sorted_value, game_value.game_id, game_value.category_id]).encode()).decode()
+
+
+def __decode_cursor(cursor: Optional[str]) -> Optional[Tuple[int, str, str]]:
+    if cursor is None:
+        return None
+    try:
+        sorted_value, game_id, category_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(sorted_value), str(game_id), str(category_id)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("after must be the next cursor of a previous page")
@@ -4,57 +4,104 @@ responses within the Global Scoreboard context
 """
 from api.api_wrappers import authentication_required
 from datetime import datetime, timedelta
-from flask import Blueprint, jsonify, request
-from models.core_models import Player
+from flask import Blueprint, current_app, jsonify, request, url_for
+from models.core_models import PayloadVersion, Player
+from models.global_scoreboard_models import PlayerRunScore, UpdateJob
 from sqlalchemy import exc
 from typing import cast, Dict, Optional
-from services.user_updater import get_updated_user
-from services.utils import UnhandledThreadException, map_to_dto, UnderALotOfPressure, UserUpdaterError
+from services.payload_cache import get_cached_payload_response
+from services.update_jobs import enqueue_update_job
+from services.utils import map_to_dto
 import configs
-import traceback
+import json
 
 api = Blueprint('global_scoreboard_api', __name__)
 
 
 @api.route('/players', methods=('GET',))
 def get_all_players():
-    return jsonify(map_to_dto(Player.get_all()))
+    return get_cached_payload_response(PayloadVersion.PLAYERS, lambda: map_to_dto(Player.get_all()))
 
 
 @api.route('/players/<id>/score-details', methods=('GET',))
 def get_player_score_details(id: str):
+    """
+    Returns the player's top runs and lesser runs: `[[...], [...]]`
+
+    Query parameters (all optional):
+    - fields: Comma separated PlayerRunScore.DTO_FIELDS, defaults to PlayerRunScore.DEFAULT_DTO_FIELDS
+    - limit: Maximum amount of runs in each list
+    """
     player = Player.get(id)
-    if player:
-        return player.score_details or ""
-    else:
+    if not player:
         return "", 404
 
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else PlayerRunScore.DEFAULT_DTO_FIELDS
+    invalid_fields = [field for field in fields if field not in PlayerRunScore.DTO_FIELDS]
+    if invalid_fields:
+        return jsonify({'message': f"Unknown fields: {', '.join(invalid_fields)}"}), 400
+    limit = request.args.get('limit')
+    if limit is not None:
+        if not limit.isdigit():
+            return jsonify({'message': "limit must be a positive integer"}), 400
+        limit = int(limit)
+
+    if not PlayerRunScore.exists_for_player(id):
+        # Players that haven't been updated since the scores were normalized
+        if not player.score_details:
+            return ""
+        return jsonify([
+            [{field: run.get(field) for field in fields} for run in runs[:limit]]
+            for runs in json.loads(player.score_details)])
+
+    run_scores = [] if limit == 0 else PlayerRunScore.get_for_player(id, limit)
+    return jsonify([
+        [run_score.to_dto(fields) for run_score in run_scores if run_score.is_top_run],
+        [run_score.to_dto(fields) for run_score in run_scores if not run_score.is_top_run],
+    ])
+
 
 @api.route('/players/<name_or_id>/update', methods=('POST',))
 def update_player(name_or_id: str):
-    try:
-        if configs.bypass_update_restrictions:
-            return __do_update_player_bypass_restrictions(name_or_id)
-        else:
-            return __do_update_player(name_or_id)
-    except UserUpdaterError as exception:
-        error_message = f"Error: {exception.args[0]['error']}\n{exception.args[0]['details']}"
-        return error_message, 424
-    except UnhandledThreadException as exception:
-        error_message = f"{type(exception).__name__}: {exception.args[0]}"
-        return error_message, 500
-    except Exception:
-        error_message = f"Error: Unknown\n{traceback.format_exc()}"
-        return error_message, 500
+    """Queues the update and answers right away. See get_update_job to follow its progress."""
+    if configs.bypass_update_restrictions:
+        return __do_update_player_bypass_restrictions(name_or_id)
+    else:
+        return __do_update_player(name_or_id)
+
+
+@api.route('/update-jobs/<id>', methods=('GET',))
+def get_update_job(id: str):
+    """
+    Answers with the job's progress while it's running.
+    Once it's done, answers with the same result and status code a synchronous update would have.
+    """
+    update_job = UpdateJob.get(id)
+    if not update_job:
+        return "", 404
+    if update_job.is_abandoned(timedelta(minutes=configs.update_job_timeout_minutes)):
+        UpdateJob.update_by_id(
+            id,
+            status=UpdateJob.STATUS_FAILED,
+            status_code=500,
+            result="Error: Update lost\nThe update stopped progressing, the server probably restarted. "
+            "Please try again.")
+        update_job = UpdateJob.get(id)
+    if not update_job.is_finished():
+        return jsonify(update_job.to_dto()), 202
+    return current_app.response_class(
+        update_job.result,
+        status=update_job.status_code,
+        mimetype="application/json" if update_job.status == UpdateJob.STATUS_DONE else "text/html")
+
+
+def __update_job_accepted(update_job: UpdateJob):
+    return jsonify(update_job.to_dto()), 202, {"Location": url_for(".get_update_job", id=update_job.job_id)}
 
 
 def __do_update_player_bypass_restrictions(name_or_id: str):
-    try:
-        result = get_updated_user(name_or_id)
-        return jsonify(result), 400 if result["state"] == "warning" else 200
-    except UnderALotOfPressure:
-        # Meme code for meme error
-        return "", 418
+    return __update_job_accepted(enqueue_update_job(name_or_id))
 
 
 __currently_updating_from: Dict[str, datetime] = {}
@@ -81,18 +128,13 @@ def __do_update_player(current_user: Player, name_or_id: str):
         return "name_or_id", 409
     __currently_updating_from[current_user.user_id] = now
     __currently_updating_to[name_or_id] = now
+    current_user_id = current_user.user_id
 
-    try:
-        # Actually do the update process
-        result = get_updated_user(name_or_id)
-    except UnderALotOfPressure:
-        # Meme code for meme error
-        return "", 418
-    finally:
-        # Upon update completing, allow the user to update again
-        __currently_updating_from.pop(current_user.user_id, None)
-
-    return jsonify(result), 400 if result["state"] == "warning" else 200
+    # Upon update completing, allow the user to update again
+    def on_update_done():
+        __currently_updating_from.pop(current_user_id, None)
+
+    return __update_job_accepted(enqueue_update_job(name_or_id, on_update_done))
 
 
 @api.route('/players/current/friends', methods=('GET',))
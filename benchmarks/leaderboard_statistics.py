@@ -0,0 +1,79 @@
+"""
+Compares the pure python and vectorized leaderboard statistics on large generated leaderboards.
+Also asserts that both give the exact same points.
+Usage: `py -m benchmarks.leaderboard_statistics [board-size ...]`
+"""
+from datetime import datetime
+from models.global_scoreboard_models import CompactLeaderboard, ScoredLeaderboard
+from services.user_updater import get_points
+from services.user_updater_helpers import get_leaderboard_statistics, get_leaderboard_statistics_vectorized
+from timeit import repeat
+from typing import Dict
+import random
+import sys
+
+DEFAULT_BOARD_SIZES = [10_000, 50_000, 100_000]
+REPEAT = 5
+BANNED_PLAYER_ID = "banned00"
+
+
+def generate_leaderboard(size: int, seed: int) -> CompactLeaderboard:
+    randomizer = random.Random(seed)
+    wr_time = randomizer.uniform(600, 3600)
+    # A lot of runners stop at the same "goal" time, which the soft cutoff is meant to remove
+    goal_time = round(wr_time * 3.5)
+    times = sorted(
+        goal_time if randomizer.random() < 0.05 else round(wr_time + randomizer.expovariate(1 / wr_time), 3)
+        for _ in range(size - 1))
+    runs = [
+        {
+            "place": 0 if randomizer.random() < 0.02 else place,
+            "run": {
+                "id": f"r{place:07d}",
+                "times": {"primary_t": primary_t},
+                "videos": None if randomizer.random() < 0.03 else {"links": [{"uri": ""}]},
+                "players": [{"id": BANNED_PLAYER_ID if randomizer.random() < 0.01 else f"p{place:07d}"}],
+            },
+        }
+        for place, primary_t in enumerate([wr_time] + times, start=1)]
+    return CompactLeaderboard(
+        {
+            "weblink": "https://www.speedrun.com/game#Any",
+            "runs": runs,
+        },
+        datetime.utcnow(),
+        frozenset([BANNED_PLAYER_ID]))
+
+
+def get_all_points(leaderboard: CompactLeaderboard, statistics_getter) -> Dict[str, str]:
+    statistics = statistics_getter(leaderboard, 1)
+    scored_leaderboard = ScoredLeaderboard(1, leaderboard.timestamp)
+    scored_leaderboard.wr_time = statistics.wr_time
+    scored_leaderboard.mean = statistics.mean
+    scored_leaderboard.worst_time = statistics.worst_time
+    scored_leaderboard.pre_cutoff_worst_time = statistics.pre_cutoff_worst_time
+    scored_leaderboard.population = statistics.population
+    # Compare the exact representation of the floats
+    return {
+        run_id: float(get_points(scored_leaderboard, primary_t)).hex()
+        for run_id, primary_t in zip(statistics.run_ids, statistics.valid_times)
+    }
+
+
+def benchmark(size: int) -> None:
+    leaderboard = generate_leaderboard(size, size)
+
+    python_points = get_all_points(leaderboard, get_leaderboard_statistics)
+    vectorized_points = get_all_points(leaderboard, get_leaderboard_statistics_vectorized)
+    assert python_points == vectorized_points, f"Points differ for a board of {size} runs"
+
+    python_time = min(repeat(lambda: get_leaderboard_statistics(leaderboard, 1), number=1, repeat=REPEAT))
+    vectorized_time = min(
+        repeat(lambda: get_leaderboard_statistics_vectorized(leaderboard, 1), number=1, repeat=REPEAT))
+    print(f"{size:>8} runs: python {python_time * 1000:8.2f}ms, vectorized {vectorized_time * 1000:8.2f}ms "
+          f"({python_time / vectorized_time:.2f}x), {len(python_points)} identical points")
+
+
+if __name__ == '__main__':
+    for board_size in [int(arg) for arg in sys.argv[1:]] or DEFAULT_BOARD_SIZES:
+        benchmark(board_size)
@@ -13,6 +13,46 @@ auto_reload_templates: bool = True
 # Custom settings
 bypass_update_restrictions: bool = True
 last_updated_days: List[int] = [7, 30, 91]
+# Updates in between full updates only fetch the runs verified since the previous update.
+# Runs that were rejected or deleted since are only noticed by a full update.
+full_update_interval_days: int = 30
+# Maximum amount of stale players refreshed by each run of the "refresh-players" scheduled task
+bulk_refresh_max_players: int = 50
+# Maximum amount of user updates running in the background at the same time, per worker.
+# Capped to leave at least 2 of the sql_pool_size database connections to the web requests and the updates' threads.
+max_concurrent_update_jobs: int = 2
+# Unfinished update jobs that haven't progressed in that long are considered lost (ie: their worker restarted)
+update_job_timeout_minutes: int = 30
+# Maximum amount of runs scored (and requests sent to speedrun.com) at the same time during a single update
+max_concurrent_requests: int = 8
+# Maximum amount of pages of a paginated speedrun.com request fetched ahead at the same time. 1 to disable
+max_prefetched_pages: int = 4
+# Maximum amount of connections kept open to speedrun.com, per worker. Requests wait for one to be free past that.
+max_connections_per_host: int = 16
+# Use the previous thread-per-run updater instead of the worker pool. Only meant to compare both implementations
+use_legacy_update_threads: bool = False
+# speedrun.com allows 100 requests per minute. Shared by all threads of a worker
+src_requests_per_minute: int = 100
+# Consecutive server errors (or connection errors) from speedrun.com before all requests are stopped
+circuit_breaker_failure_threshold: int = 5
+# How long requests stay stopped once the above is reached. Shared by all workers
+circuit_breaker_cooldown_seconds: int = 120
+# Approximate memory budget of the in-process speedrun.com responses cache, per worker
+request_cache_max_megabytes: int = 256
+# Approximate memory budget of the in-process cache of compact leaderboards, per worker
+leaderboards_cache_max_megabytes: int = 64
+# Approximate memory budget of the in-process cache of scored leaderboards, per worker
+scored_leaderboards_cache_max_megabytes: int = 64
+# Approximate memory budget of the in-process cache of games' levels and variables, per worker
+game_metadata_cache_max_megabytes: int = 16
+# Games' levels and variables are only requested again after that many days
+game_metadata_cache_days: int = 30
+# How often each worker reloads the banned players found by the others
+banned_players_refresh_minutes: int = 60
+# How long a failed paginated request (ie: a runner's runs) can be resumed from where it stopped, per worker
+pagination_checkpoint_minutes: int = 60
+# Approximate memory budget of those resumable paginated requests, per worker
+pagination_checkpoints_cache_max_megabytes: int = 64
 # Timezone: https://momentjs.com/timezone/#format-dates-in-any-timezone
 server_timezone: str = "America/New_York"
 
@@ -23,3 +63,5 @@ sql_username: str = "admin"
 sql_password: str = "admin"
 sql_hostname: str = "localhost:3356"
 sql_database_name: str = "speedrun_global_scoreboard"
+# Database connections per worker, with no overflow. PythonAnywhere allows 3 per webworker
+sql_pool_size: int = 3
@@ -56,7 +56,7 @@ SQLALCHEMY_DATABASE_URI = "mysql+{connector}://{username}:{password}@{hostname}/
     database_name=configs.sql_database_name)
 app.config["SQLALCHEMY_DATABASE_URI"] = SQLALCHEMY_DATABASE_URI
 app.config["SQLALCHEMY_POOL_RECYCLE"] = 299
-app.config["SQLALCHEMY_POOL_SIZE"] = 3  # PythonAnywhere allows 3 connections per webworker
+app.config["SQLALCHEMY_POOL_SIZE"] = configs.sql_pool_size
 app.config["SQLALCHEMY_MAX_OVERFLOW"] = 0
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = configs.sql_track_modifications
 db.app = app
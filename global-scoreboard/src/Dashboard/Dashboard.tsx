@@ -8,6 +8,7 @@ import type { AlertProps } from 'react-bootstrap/Alert'
 import { apiDelete, apiGet, apiPost, apiPut } from '../fetchers/Api'
 import Configs from '../models/Configs'
 import type Player from '../models/Player'
+import type UpdateJob from '../models/UpdateJob'
 import type UpdateRunnerResult from '../models/UpdateRunnerResult'
 import QuickView from './QuickView/QuickView'
 import type { ScoreboardRef } from './Scoreboard'
@@ -28,6 +29,29 @@ const getAllPlayers = () => apiGet('players')
       lastUpdate: new Date(player.lastUpdate),
     })))
 
+const UPDATE_JOB_POLLING_INTERVAL = 2000
+// A bit longer than the server's update_job_timeout_minutes, so that it usually gets to say the job was lost
+const UPDATE_JOB_POLLING_TIMEOUT = 35 * 60 * 1000
+
+// Updates run in the background. Keep asking for the job until it answers with its actual result
+const waitForUpdateJob = (
+  res: Response,
+  onProgress: (job: UpdateJob) => void,
+  deadline = Date.now() + UPDATE_JOB_POLLING_TIMEOUT
+): Promise<Response> =>
+  res.status === StatusCodes.ACCEPTED
+    ? res.json()
+      .then((job: UpdateJob) => {
+        onProgress(job)
+        if (Date.now() >= deadline) {
+          throw new Error('The update is taking too long. Please try again later.')
+        }
+        return new Promise<UpdateJob>(resolve => setTimeout(() => resolve(job), UPDATE_JOB_POLLING_INTERVAL))
+      })
+      .then(job => apiGet(`update-jobs/${job.jobId}`))
+      .then(nextRes => waitForUpdateJob(nextRes, onProgress, deadline))
+    : Promise.resolve(res)
+
 const validateRunnerNotRecentlyUpdated = (runnerNameOrId: string, players: Player[]) => {
   const yesterday = new Date()
   yesterday.setDate(yesterday.getDate() - 1)
@@ -50,6 +74,11 @@ const inferRank = (players: Player[], score: number) => {
     : lowerOrEqualPlayerFoundIndex + 1
 }
 
+const formatRankChange = (rankChange: number | null | undefined) =>
+  rankChange
+    ? ` Moved ${rankChange > 0 ? 'up' : 'down'} ${Math.abs(rankChange)} rank${Math.abs(rankChange) === 1 ? '' : 's'}.`
+    : ''
+
 // Let's cheat! This is much simpler and more effective
 const openLoginModal = () => document.getElementById('open-login-modal-button')?.click()
 
@@ -107,6 +136,10 @@ const Dashboard = (props: DashboardProps) => {
     }
     setUpdateStartTime(Date.now())
     apiPost(`players/${runnerNameOrId}/update`)
+      .then(res => waitForUpdateJob(res, job => {
+        if (job.progress.total == null) return
+        setAlertMessage(`Updating "${runnerNameOrId}". ${job.progress.done}/${job.progress.total} runs analysed. Please Wait...`)
+      }))
       .then<UpdateRunnerResult>(res => res.json())
       .then(playerResult => {
         playerResult.lastUpdate = new Date(playerResult.lastUpdate)
@@ -114,10 +147,10 @@ const Dashboard = (props: DashboardProps) => {
       })
       .then(result => {
         setAlertVariant(result.state)
-        setAlertMessage(renderScoreTable(result.scoreDetails ?? [[], []], result.message))
+        setAlertMessage(renderScoreTable(result.scoreDetails ?? [[], []], result.message + formatRankChange(result.rankChange)))
         const newPlayers = [...playersState]
         const existingPlayerIndex = newPlayers.findIndex(player => player.userId === result.userId)
-        const inferedRank = inferRank(newPlayers, result.score)
+        const inferedRank = result.rank ?? inferRank(newPlayers, result.score)
         const playerModifications = {
           rank: inferedRank,
           name: result.name,
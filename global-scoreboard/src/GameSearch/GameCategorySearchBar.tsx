@@ -1,6 +1,5 @@
 import type { Dispatch, SetStateAction } from 'react'
 import { FormControl, FormLabel } from 'react-bootstrap'
-import type { SearchFieldProps, SearchProps } from 'react-bootstrap-table2-toolkit'
 
 import { apiGet, MAX_PAGINATION } from '../fetchers/Api'
 import type { DataArray, SrcGame } from '../models/SrcResponse'
@@ -8,10 +7,14 @@ import math from '../utils/Math'
 
 type IdToNameMap = Record<string, string>
 
-type GameCategorySearchProps =
-  SearchFieldProps & SearchProps & {
-    setGameMap: Dispatch<SetStateAction<IdToNameMap>>
-  }
+type GameCategorySearchProps = {
+  className?: string
+  placeholder?: string
+  setGameMap: Dispatch<SetStateAction<IdToNameMap>>
+  // Also given the games found on speedrun.com for "searchText", as "setGameMap" only applies on the next render
+  onSearch: (searchText: string, games: IdToNameMap) => void
+  onClear: () => void
+}
 
 function debounce<T>(fn: (...args: T[]) => void, time: number) {
   let timeout: NodeJS.Timeout | undefined
@@ -34,7 +37,7 @@ const GameCategorySearch = (props: GameCategorySearchProps) => {
   const handleOnChange = debounce(
     (searchText: string) =>
       !searchText
-        ? props.onClear?.()
+        ? props.onClear()
         : apiGet('https://www.speedrun.com/api/v1/games', { name: searchText, max: MAX_PAGINATION }, false)
           .then<DataArray<SrcGame>>(res => res.json())
           .then(res => res.data)
@@ -45,7 +48,7 @@ const GameCategorySearch = (props: GameCategorySearchProps) => {
               localStorage.setItem('games', JSON.stringify(newGames))
               return newGames
             })
-            props.onSearch?.(searchText)
+            props.onSearch(searchText, games)
           }),
     DEBOUNCE_TIME
   )
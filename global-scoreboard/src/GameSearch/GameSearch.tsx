@@ -1,4 +1,3 @@
-import 'react-bootstrap-table2-paginator/dist/react-bootstrap-table2-paginator.min.css'
 import '../Dashboard/Scoreboard.css'
 import './GameSearch.css'
 
@@ -6,16 +5,11 @@ import { faExternalLinkAlt } from '@fortawesome/free-solid-svg-icons'
 import { FontAwesomeIcon } from '@fortawesome/react-fontawesome'
 import type { ChangeEventHandler, Dispatch, SetStateAction } from 'react'
 import { useEffect, useState } from 'react'
-import { Container, FormControl, InputGroup, Spinner } from 'react-bootstrap'
+import { Container, Dropdown, DropdownButton, FormControl, InputGroup, Pagination, Spinner } from 'react-bootstrap'
 import type { Column } from 'react-bootstrap-table-next'
 import BootstrapTable from 'react-bootstrap-table-next'
-import filterFactory, { Comparator, multiSelectFilter, numberFilter } from 'react-bootstrap-table2-filter'
-import paginationFactory, { PaginationListStandalone, PaginationProvider, PaginationTotalStandalone, SizePerPageDropdownStandalone } from 'react-bootstrap-table2-paginator'
-import type { ToolkitProviderProps } from 'react-bootstrap-table2-toolkit'
-import ToolkitProvider from 'react-bootstrap-table2-toolkit'
 import { Picky } from 'react-picky'
 
-import defaultPaginationOptions from '../Dashboard/TableElements/PaginationProps'
 import sortCaret from '../Dashboard/TableElements/SortCarret'
 import { apiGet, MAX_PAGINATION } from '../fetchers/Api'
 import type { EmbeddedSrcRun } from '../models/SrcResponse'
@@ -46,6 +40,32 @@ type GameValueRow = GameValue & {
   meanPointsPerSecond: number
 }
 
+type GameValuesPage<T> = {
+  data: T[]
+  next: string | null
+}
+
+type GameValuesOrderBy = 'wrPoints' | 'wrTime' | 'wrPointsPerHour'
+
+type GameValuesSort = {
+  dataField: string
+  order: SortOrder
+}
+
+// Game values of any of those games or of any of those categories
+type SearchedIds = {
+  gameIds: string[]
+  categoryIds: string[]
+}
+
+type GameValuesFilters = {
+  platformIds: string[]
+  // Undefined when not searching
+  searchedIds: SearchedIds | undefined
+  minMeanTime: number | ''
+  maxWrTime: number | ''
+}
+
 type PlatformSelectOption = {
   id: string
   name: string
@@ -59,9 +79,20 @@ type FormatExtraDataProps = {
   setCategoryMap: Dispatch<SetStateAction<IdToNameMap>>
 }
 
-let platformFilter: SelectFilterFunction
-let minTimeFilter: NumberFilterFunction
-let maxTimeFilter: NumberFilterFunction
+// eslint-disable-next-line @typescript-eslint/no-magic-numbers
+const SIZE_PER_PAGE_LIST = [10, 25, 50, 100]
+
+// The columns the server can sort the game values by
+const ORDER_BY_FIELDS: Record<string, GameValuesOrderBy> = {
+  wrTime: 'wrTime',
+  wrPointsPerSecond: 'wrPointsPerHour',
+  wrPoints: 'wrPoints',
+}
+
+const DEFAULT_SORT: GameValuesSort = {
+  dataField: 'wrPoints',
+  order: 'desc',
+}
 
 const runIdFormatter = (_cell: unknown, row: GameValueRow | undefined, _rowIndex: number, formatExtraData?: FormatExtraDataProps) => {
   if (!row || !formatExtraData) return ''
@@ -89,7 +120,6 @@ const columns: Column[] = [
   {
     dataField: 'runId',
     text: '',
-    searchable: false,
     formatter: runIdFormatter,
   },
   {
@@ -118,29 +148,18 @@ const columns: Column[] = [
         formatExtraData &&
         formatExtraData.platforms[row.platformId]) ||
       '-',
-    filter: multiSelectFilter({
-      options: {},
-      getFilter: filter => platformFilter = filter,
-      style: { 'display': 'none' },
-    }),
   },
   {
     dataField: 'wrTime',
     text: 'WR Time',
-    searchable: false,
     sort: true,
     formatter: (_, row: GameValueRow | undefined) =>
       row &&
       secondsToTimeString(row.wrTime),
-    filter: numberFilter({
-      getFilter: filter => maxTimeFilter = filter,
-      style: { 'display': 'none' },
-    }),
   },
   {
     dataField: 'wrPointsPerSecond',
     text: 'WR Points/Time',
-    searchable: false,
     sort: true,
     formatter: (_, row: GameValueRow | undefined) =>
       row &&
@@ -149,14 +168,11 @@ const columns: Column[] = [
   {
     dataField: 'wrPoints',
     text: 'WR Points',
-    searchable: false,
     sort: true,
   },
   {
     dataField: 'meanPointsPerSecond',
     text: 'WR Points/Avg Time',
-    searchable: false,
-    sort: true,
     formatter: (_, row: GameValueRow | undefined) =>
       row &&
       `${math.perSecondToPerMinute(row.meanPointsPerSecond)} pt/m`,
@@ -164,26 +180,33 @@ const columns: Column[] = [
   {
     dataField: 'meanTime',
     text: 'Avg Time',
-    searchable: false,
-    sort: true,
     formatter: (_, row: GameValueRow | undefined) =>
       row &&
       secondsToTimeString(row.meanTime),
-    filter: numberFilter({
-      getFilter: filter => minTimeFilter = filter,
-      style: { 'display': 'none' },
-    }),
   },
 ]
 
-const getAllGameValues = () =>
-  apiGet('game-values')
-    .then<GameValue[]>(res => res.json())
-    .then<GameValueRow[]>(gameValues => gameValues.map(gameValue => ({
-      ...gameValue,
-      wrPointsPerSecond: gameValue.wrPoints / gameValue.wrTime,
-      meanPointsPerSecond: gameValue.wrPoints / gameValue.meanTime,
-    })))
+const getGameValuesPage = (filters: GameValuesFilters, sort: GameValuesSort, limit: number, after: string | undefined) =>
+  apiGet('game-values', {
+    platform: filters.platformIds,
+    game: filters.searchedIds?.gameIds ?? [],
+    category: filters.searchedIds?.categoryIds ?? [],
+    ...(filters.minMeanTime !== '' && { minMeanTime: filters.minMeanTime }),
+    ...(filters.maxWrTime !== '' && { maxWrTime: filters.maxWrTime }),
+    orderBy: ORDER_BY_FIELDS[sort.dataField],
+    order: sort.order,
+    limit,
+    ...(after && { after }),
+  })
+    .then<GameValuesPage<GameValue>>(res => res.json())
+    .then<GameValuesPage<GameValueRow>>(page => ({
+      next: page.next,
+      data: page.data.map(gameValue => ({
+        ...gameValue,
+        wrPointsPerSecond: gameValue.wrPoints / gameValue.wrTime,
+        meanPointsPerSecond: gameValue.wrPoints / gameValue.meanTime,
+      })),
+    }))
 
 const getAllPlatforms = () => apiGet('https://www.speedrun.com/api/v1/platforms', { max: MAX_PAGINATION }, false)
   .then<{ data: PlatformDto[] }>(res => res.json())
@@ -206,156 +229,226 @@ const fetchValueNamesForRun = async (runId: string) => {
 }
 
 const GameSearch = () => {
-  const [gameValues, setGameValues] = useState<GameValueRow[]>([])
+  const [gameValues, setGameValues] = useState<GameValueRow[]>()
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  // The cursor of every page up to the displayed one, the first page not having any
+  const [pageCursors, setPageCursors] = useState<(string | undefined)[]>([undefined])
+  const [sizePerPage, setSizePerPage] = useState(SIZE_PER_PAGE_LIST[0])
+  const [sort, setSort] = useState(DEFAULT_SORT)
   const [platforms, setPlatforms] = useState<IdToNameMap>()
-  const [selectedPlatforms, setSelectedPlatforms] = useState<PlatformSelectOption[]>([])
+  const [selectedPlatforms, setSelectedPlatforms] = useState<PlatformSelectOption[]>(() =>
+    JSON.parse(localStorage.getItem('selectedPlatforms') ?? '[]'))
   const [gameMap, setGameMap] = useState<IdToNameMap>({})
   const [categoryMap, setCategoryMap] = useState<IdToNameMap>({})
-  const [minTimeText, setMinTimeText] = useState('')
-  const [maxTimeText, setMaxTimeText] = useState('')
+  const [minTimeText, setMinTimeText] = useState<string>(() =>
+    JSON.parse(localStorage.getItem('selectedMinTime') ?? '""'))
+  const [maxTimeText, setMaxTimeText] = useState<string>(() =>
+    JSON.parse(localStorage.getItem('selectedMaxTime') ?? '""'))
+  const [searchedIds, setSearchedIds] = useState<SearchedIds>()
 
   useEffect(() => {
     setGameMap(JSON.parse(localStorage.getItem('games') ?? '{}'))
     setCategoryMap(JSON.parse(localStorage.getItem('categories') ?? '{}'))
-    doPlatformSelection(JSON.parse(localStorage.getItem('selectedPlatforms') ?? '[]'))
-    doMinTimeChange(JSON.parse(localStorage.getItem('selectedMinTime') ?? '""'))
-    doMaxTimeChange(JSON.parse(localStorage.getItem('selectedMaxTime') ?? '""'))
-    void getAllGameValues().then(setGameValues)
     void getAllPlatforms().then(setPlatforms)
   }, [])
 
-  const doPlatformSelection = (selectedPlatformOptions: PlatformSelectOption[]) => {
-    platformFilter(selectedPlatformOptions.map(platform => platform.id))
-    setSelectedPlatforms(selectedPlatformOptions)
-  }
+  useEffect(() => {
+    // Drops the page if the filters changed while it was loading
+    let isOutdated = false
+    setNextCursor(null)
+    // No known game or category name matches the search, without ids the server wouldn't filter anything
+    if (searchedIds && searchedIds.gameIds.length === 0 && searchedIds.categoryIds.length === 0) {
+      setGameValues([])
+      return
+    }
+    setGameValues(undefined)
+    void getGameValuesPage(
+      {
+        platformIds: selectedPlatforms.map(platform => platform.id),
+        searchedIds,
+        minMeanTime: timeStringToSeconds(minTimeText),
+        maxWrTime: timeStringToSeconds(maxTimeText),
+      },
+      sort,
+      sizePerPage,
+      pageCursors[pageCursors.length - 1],
+    ).then(page => {
+      if (isOutdated) return
+      setGameValues(page.data)
+      setNextCursor(page.next)
+    })
+    return () => {
+      isOutdated = true
+    }
+  }, [selectedPlatforms, searchedIds, minTimeText, maxTimeText, sort, sizePerPage, pageCursors])
+
+  const goToFirstPage = () => setPageCursors([undefined])
+
   const handlePlatformSelection = (selectedPlatformOptions: PlatformSelectOption[]) => {
-    doPlatformSelection(selectedPlatformOptions)
+    setSelectedPlatforms(selectedPlatformOptions)
+    goToFirstPage()
     localStorage.setItem('selectedPlatforms', JSON.stringify(selectedPlatformOptions))
   }
 
-  const doMinTimeChange = (minTime: string) => {
-    setMinTimeText(minTime)
-    minTimeFilter({
-      number: timeStringToSeconds(minTime),
-      comparator: Comparator.GE,
+  // Only the names loaded so far can be searched: those of the games found on speedrun.com
+  // and those of the games and categories that have been displayed before
+  const handleSearch = (searchText: string, foundGames: IdToNameMap) => {
+    const matchingIds = (names: IdToNameMap) => Object
+      .entries(names)
+      .filter(([, name]) => name.toLowerCase().includes(searchText.toLowerCase()))
+      .map(([id]) => id)
+    setSearchedIds({
+      gameIds: matchingIds({ ...gameMap, ...foundGames }),
+      categoryIds: matchingIds(categoryMap),
     })
+    goToFirstPage()
   }
+  const handleSearchClear = () => {
+    setSearchedIds(undefined)
+    goToFirstPage()
+  }
+
   const handleMinTimeChange: ChangeEventHandler<HTMLInputElement> = event => {
     if (!(/^[1-9]?[\d:]{0,7}\d?$/).test(event.currentTarget.value)) return
-    doMinTimeChange(event.currentTarget.value)
+    setMinTimeText(event.currentTarget.value)
+    goToFirstPage()
     localStorage.setItem('selectedMinTime', JSON.stringify(event.currentTarget.value))
   }
 
-  const doMaxTimeChange = (maxTime: string) => {
-    setMaxTimeText(maxTime)
-    maxTimeFilter({
-      number: timeStringToSeconds(maxTime),
-      comparator: Comparator.LE,
-    })
-  }
   const handleMaxTimeChange: ChangeEventHandler<HTMLInputElement> = event => {
     if (!(/^[1-9]?[\d:]{0,7}\d?$/).test(event.currentTarget.value)) return
-    doMaxTimeChange(event.currentTarget.value)
+    setMaxTimeText(event.currentTarget.value)
+    goToFirstPage()
     localStorage.setItem('selectedMaxTime', JSON.stringify(event.currentTarget.value))
   }
 
+  const handleSizePerPageChange = (newSizePerPage: number) => {
+    setSizePerPage(newSizePerPage)
+    goToFirstPage()
+  }
+
+  // Sorting is done by the server, as only the displayed page is loaded
+  const handleTableChange = (type: TableChangeType, { sortField, sortOrder }: TableChangeNewState) => {
+    if (type !== 'sort' || !sortField || !sortOrder) return
+    // The table sends its default sort when mounted
+    if (sortField === sort.dataField && sortOrder === sort.order) return
+    setSort({ dataField: sortField, order: sortOrder })
+    goToFirstPage()
+  }
+
   const buildPlatformsOptions = () =>
     Object
       .entries(platforms ?? {})
-      .filter(([id]) => gameValues.some(gameValue => gameValue.platformId === id))
       .map(([id, name]) => ({ id, name } as PlatformSelectOption))
 
+  const firstRowNumber = (pageCursors.length - 1) * sizePerPage + 1
+
   return <Container>
     <br />
-    <ToolkitProvider
-      keyField='runId'
-      data={gameValues}
-      columns={columns.map(column => {
-        if (!platforms) return column
-        const formatExtraData: FormatExtraDataProps = { platforms, gameMap, setGameMap, categoryMap, setCategoryMap }
-        return { ...column, formatExtraData, sortCaret }
-      })}
-      search={{
-        searchFormatted: true,
-      }}
-      bootstrap4
-    >
-      {(toolkitprops: ToolkitProviderProps) =>
-        <PaginationProvider
-          pagination={paginationFactory({
-            ...defaultPaginationOptions,
-            totalSize: gameValues.length,
-          })}
+    <div>
+      <GameCategorySearch
+        placeholder='Game / Category search'
+        setGameMap={setGameMap}
+        onSearch={handleSearch}
+        onClear={handleSearchClear}
+      />
+      <Picky
+        id='platform-multiselect'
+        valueKey='id'
+        labelKey='name'
+        buttonProps={{ 'className': 'form-control' }}
+        placeholder='Filter by platforms'
+        manySelectedPlaceholder='%s platforms selected'
+        allSelectedPlaceholder='All platforms selected'
+        numberDisplayed={1}
+        options={buildPlatformsOptions()}
+        value={selectedPlatforms}
+        multiple={true}
+        includeSelectAll={true}
+        includeFilter={true}
+        onChange={values => handlePlatformSelection(values as PlatformSelectOption[])}
+      />
+      <div className='time-between'>
+        <label>Time between</label>
+        <InputGroup>
+          <FormControl
+            name='min-time'
+            placeholder='Min Avg'
+            value={minTimeText}
+            onChange={handleMinTimeChange} />
+          <InputGroup.Append className='input-group-prepend'>
+            <InputGroup.Text>-</InputGroup.Text>
+          </InputGroup.Append>
+          <FormControl
+            name='max-time'
+            placeholder='Max WR'
+            value={maxTimeText}
+            onChange={handleMaxTimeChange} />
+        </InputGroup>
+      </div>
+      <span className='react-bs-table-sizePerPage-dropdown float-right'>
+        {'Show '}
+        <DropdownButton
+          id='pageDropDown'
+          variant='outline-primary'
+          alignRight
+          title={sizePerPage}
+          style={{ display: 'inline-block' }}
         >
-          {(({ paginationProps, paginationTableProps }) =>
-            <div>
-              <GameCategorySearch
-                {...toolkitprops.searchProps}
-                placeholder='Game / Category search'
-                setGameMap={setGameMap}
-              />
-              <Picky
-                id='platform-multiselect'
-                valueKey='id'
-                labelKey='name'
-                buttonProps={{ 'className': 'form-control' }}
-                placeholder='Filter by platforms'
-                manySelectedPlaceholder='%s platforms selected'
-                allSelectedPlaceholder='All platforms selected'
-                numberDisplayed={1}
-                options={buildPlatformsOptions()}
-                value={selectedPlatforms}
-                multiple={true}
-                includeSelectAll={true}
-                includeFilter={true}
-                onChange={values => handlePlatformSelection(values as PlatformSelectOption[])}
-              />
-              <div className='time-between'>
-                <label>Time between</label>
-                <InputGroup>
-                  <FormControl
-                    name='min-time'
-                    placeholder='Min Avg'
-                    value={minTimeText}
-                    onChange={handleMinTimeChange} />
-                  <InputGroup.Append className='input-group-prepend'>
-                    <InputGroup.Text>-</InputGroup.Text>
-                  </InputGroup.Append>
-                  <FormControl
-                    name='max-time'
-                    placeholder='Max WR'
-                    value={maxTimeText}
-                    onChange={handleMaxTimeChange} />
-                </InputGroup>
-              </div>
-              <SizePerPageDropdownStandalone {...paginationProps} />
-              <BootstrapTable
-                wrapperClasses='table-responsive'
-                striped
-                {...toolkitprops.baseProps}
-                {...paginationTableProps}
-                noDataIndication={() =>
-                  gameValues.length === 0 || !platforms
-                    ? <Spinner animation='border' role='scoreboard'>
-                      <span className='sr-only'>Building the GameSearch. Please wait...</span>
-                    </Spinner>
-                    : <span>No matching records found</span>
-                }
-                defaultSorted={[{
-                  dataField: 'wrPoints',
-                  order: 'desc',
-                }]}
-                filter={filterFactory()}
-              />
-              <div>
-                <PaginationTotalStandalone {...paginationProps} />
-                <PaginationListStandalone {...paginationProps} />
-              </div>
-            </div>
-          )}
-        </PaginationProvider>
-      }
-    </ToolkitProvider>
+          {
+            SIZE_PER_PAGE_LIST.map(option =>
+              <Dropdown.Item
+                key={`data-page-${option}`}
+                href='#'
+                active={sizePerPage === option}
+                onClick={() => handleSizePerPageChange(option)}
+              >
+                {option}
+              </Dropdown.Item>)
+          }
+        </DropdownButton>
+        {' entries'}
+      </span>
+      <BootstrapTable
+        wrapperClasses='table-responsive'
+        striped
+        keyField='runId'
+        data={gameValues ?? []}
+        columns={columns.map(column => {
+          if (!platforms) return column
+          const formatExtraData: FormatExtraDataProps = { platforms, gameMap, setGameMap, categoryMap, setCategoryMap }
+          return { ...column, formatExtraData, sortCaret }
+        })}
+        bootstrap4
+        remote={{ sort: true }}
+        onTableChange={handleTableChange}
+        noDataIndication={() =>
+          !gameValues || !platforms
+            ? <Spinner animation='border' role='scoreboard'>
+              <span className='sr-only'>Building the GameSearch. Please wait...</span>
+            </Spinner>
+            : <span>No matching records found</span>
+        }
+        defaultSorted={[DEFAULT_SORT]}
+      />
+      <div>
+        {gameValues && gameValues.length > 0 &&
+          <span className='react-bootstrap-table-pagination-total'>
+            {`Showing rows ${firstRowNumber} to ${firstRowNumber + gameValues.length - 1}`}
+          </span>}
+        <Pagination className='float-right'>
+          <Pagination.Prev
+            disabled={pageCursors.length === 1}
+            onClick={() => setPageCursors(cursors => cursors.slice(0, -1))}
+          />
+          <Pagination.Item active>{pageCursors.length}</Pagination.Item>
+          <Pagination.Next
+            disabled={!nextCursor}
+            onClick={() => nextCursor && setPageCursors(cursors => [...cursors, nextCursor])}
+          />
+        </Pagination>
+      </div>
+    </div>
     <ScoreDropCalculator />
   </Container >
 }
@@ -1,4 +1,6 @@
-type QueryParams = Record<string, boolean | number | string | null>
+type QueryParamValue = boolean | number | string | null
+// Arrays are sent as repeated parameters
+type QueryParams = Record<string, QueryParamValue | QueryParamValue[]>
 
 const FIRST_HTTP_CODE = 400
 const LAST_HTTP_CODE = 599
@@ -8,7 +10,10 @@ const makeUrl = (location: string, queryParams?: QueryParams) => {
   const targetUrl = location.startsWith('http')
     ? location
     : `${window.process.env.REACT_APP_BASE_URL}/api/${location}`
-  const query = new URLSearchParams(queryParams as Record<string, string>).toString()
+  const searchParams = new URLSearchParams()
+  Object.entries(queryParams ?? {}).forEach(([name, value]) =>
+    (Array.isArray(value) ? value : [value]).forEach(item => searchParams.append(name, String(item))))
+  const query = searchParams.toString()
   return query
     ? `${targetUrl}?${query}`
     : targetUrl
@@ -0,0 +1,10 @@
+type UpdateJob = {
+  jobId: string
+  nameOrId: string
+  status: 'done' | 'failed' | 'queued' | 'running'
+  progress: {
+    done: number
+    total: number | null
+  }
+}
+export default UpdateJob
@@ -6,6 +6,10 @@ type UpdateRunnerResult =
   {
     state?: AlertProps['variant']
     message: string
+    /** Positive when climbing the scoreboard */
+    rankChange?: number | null
+    /** Some runs were scored from older leaderboards because speedrun.com was unavailable */
+    isProvisional?: boolean
   }
 export default UpdateRunnerResult
 
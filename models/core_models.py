@@ -1,7 +1,7 @@
 from __future__ import annotations
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import orm, text
+from sqlalchemy import or_, orm, text
 from typing import cast, Dict, List, Optional, Tuple, Union
 from services.utils import get_file, SpeedrunComError, UserUpdaterError
 import sys
@@ -34,7 +34,10 @@ class Player(db.Model):
     score: int = db.Column(db.Integer, nullable=False)
     score_details: str = db.Column(db.String())
     last_update: Optional[datetime] = db.Column(db.DateTime())
-    rank: Optional[int] = None
+    # Updates in between only fetch the runs verified since the previous update
+    last_full_update: Optional[datetime] = db.Column(db.DateTime())
+    # 1 + the amount of players with a strictly higher score. Kept up to date by create, update and delete
+    rank: Optional[int] = db.Column(db.Integer)
 
     schedules = db.relationship("Schedule", back_populates="owner")
 
@@ -72,15 +75,9 @@ class Player(db.Model):
 
     @staticmethod
     def get_all():
-        sql = text("SELECT user_id, name, country_code, score, last_update, CONVERT(rank, SIGNED INT) rank FROM ( "
-                   "    SELECT *, "
-                   "        IF(score = @_last_score, @cur_rank := @cur_rank, @cur_rank := @_sequence) AS rank, "
-                   "        @_sequence := @_sequence + 1, "
-                   "        @_last_score := score "
-                   "    FROM player, (SELECT @cur_rank := 1, @_sequence := 1, @_last_score := NULL) r "
-                   "    WHERE score > 0 "
-                   "    ORDER BY score DESC "
-                   ") ranked;")
+        sql = text("SELECT user_id, name, country_code, score, last_update, `rank` FROM player "
+                   "WHERE `rank` IS NOT NULL "
+                   "ORDER BY `rank`;")
         return [Player(
             user_id=player[0],
             name=player[1],
@@ -90,38 +87,129 @@ class Player(db.Model):
             rank=player[5]) for player in db.engine.execute(sql).fetchall()]
 
     @staticmethod
-    def create(user_id: str, name: str, **kwargs: Union[Optional[str], float, datetime]) -> Player:
+    def recompute_ranks() -> None:
+        """Ranks everyone from scratch. Ranks are otherwise updated incrementally, this is only needed to fix drifts."""
+        sql = text("UPDATE player p JOIN ( "
+                   "    SELECT user_id, "
+                   "        IF(score = @_last_score, @cur_rank := @cur_rank, @cur_rank := @_sequence) AS new_rank, "
+                   "        @_sequence := @_sequence + 1, "
+                   "        @_last_score := score "
+                   "    FROM player, (SELECT @cur_rank := 1, @_sequence := 1, @_last_score := NULL) r "
+                   "    WHERE score > 0 "
+                   "    ORDER BY score DESC "
+                   ") ranked ON ranked.user_id = p.user_id "
+                   "SET p.`rank` = ranked.new_rank;")
+        db.session.execute(sql)
+        db.session.execute(text("UPDATE player SET `rank` = NULL WHERE score <= 0;"))
+        PayloadVersion.increment(PayloadVersion.PLAYERS)
+        db.session.commit()
+
+    @staticmethod
+    def get_stale(days: int, limit: int, max_days: Optional[int] = None) -> List[Player]:
+        """
+        Returns the players that haven't been updated in at least "days" days,
+        but have been in the past "max_days" days if specified (excluding the players that have never been updated).
+        The ones that have been waiting the longest (or have never been updated) come first.
+        """
+        stale_date = datetime.now() - timedelta(days=days)
+        query = Player.query
+        if max_days is None:
+            query = query.filter(or_(Player.last_update.is_(None), Player.last_update <= stale_date))
+        else:
+            query = query.filter(
+                Player.last_update <= stale_date,
+                Player.last_update > datetime.now() - timedelta(days=max_days))
+        return query \
+            .order_by(Player.last_update.is_(None).desc(), Player.last_update) \
+            .limit(limit) \
+            .all()
+
+    @staticmethod
+    def create(user_id: str, name: str, *, commit: bool = True, **kwargs: Union[Optional[str], float, datetime]) \
+            -> Player:
         """
+        Without "commit", the caller is responsible for committing (ie: along with the player's run scores).
         kwargs:
         - score: int
         - last_update: Union[datetime, str]
+        - last_full_update: Union[datetime, str]
         """
         score = kwargs.get('score', 0)
         last_update = kwargs.get('last_update', None)
+        last_full_update = kwargs.get('last_full_update', None)
 
         player = Player(
             user_id=user_id,
             name=name,
             score=score,
-            last_update=last_update)
+            last_update=last_update,
+            last_full_update=last_full_update)
         db.session.add(player)
-        db.session.commit()
+        db.session.flush()
+        Player._update_ranks(user_id, 0, Player._get_score_for_update(user_id))
+        PayloadVersion.increment(PayloadVersion.PLAYERS)
+        if commit:
+            db.session.commit()
 
         return player
 
-    def update(self, **kwargs: Union[Optional[str], float, datetime]) -> Player:
+    def update(self, *, commit: bool = True, **kwargs: Union[Optional[str], float, datetime]) -> Player:
+        """Without "commit", the caller is responsible for committing (ie: along with the player's run scores)"""
+        old_score = Player._get_score_for_update(self.user_id) if 'score' in kwargs else None
         player = Player \
             .query \
             .filter(Player.user_id == self.user_id) \
             .update(kwargs)
-        db.session.commit()
+        if old_score is not None:
+            Player._update_ranks(self.user_id, old_score, Player._get_score_for_update(self.user_id))
+        PayloadVersion.increment(PayloadVersion.PLAYERS)
+        if commit:
+            db.session.commit()
         return player
 
     def delete(self) -> bool:
+        Player._update_ranks(self.user_id, Player._get_score_for_update(self.user_id), 0)
+        PayloadVersion.increment(PayloadVersion.PLAYERS)
         db.session.delete(self)
         db.session.commit()
         return True
 
+    @staticmethod
+    def _get_score_for_update(user_id: str) -> int:
+        """The score as stored (and rounded) by the database. Locks the row until the end of the transaction."""
+        return db.session \
+            .query(Player.score) \
+            .filter(Player.user_id == user_id) \
+            .with_for_update() \
+            .scalar() or 0
+
+    @staticmethod
+    def _update_ranks(user_id: str, old_score: int, new_score: int) -> None:
+        """
+        Only the players with a score in between the old and new score need to move by one rank.
+        Players with a score of 0 or less aren't ranked. Must be committed by the caller.
+        """
+        old_score = max(old_score, 0)
+        new_score = max(new_score, 0)
+        if new_score != old_score:
+            sql = text("UPDATE player SET `rank` = `rank` + :shift "
+                       "WHERE score > 0 AND score >= :lowest_score AND score < :highest_score "
+                       "AND user_id != :user_id;")
+            db.session.execute(sql, {
+                "shift": 1 if new_score > old_score else -1,
+                "lowest_score": min(old_score, new_score),
+                "highest_score": max(old_score, new_score),
+                "user_id": user_id,
+            })
+
+        if new_score > 0:
+            sql = text("SELECT COUNT(*) + 1 FROM player WHERE score > :score;")
+            new_rank = db.session.execute(sql, {"score": new_score}).scalar()
+        else:
+            new_rank = None
+        sql = text("UPDATE player SET `rank` = :rank WHERE user_id = :user_id;")
+        db.session.execute(sql, {"rank": new_rank, "user_id": user_id})
+
     def get_friends(self) -> List[Player]:
         sql = text("SELECT f.friend_id, p.name, p.country_code, p.score, p.last_update FROM friend f "
                    "JOIN player p ON p.user_id = f.friend_id "
@@ -318,5 +406,31 @@ class Player(db.Model):
         }
 
 
+class PayloadVersion(db.Model):
+    """
+    Incremented in the same transaction as any write to the data behind a cached API payload.
+    Shared by every worker, so any of them knows when its own cached payload is outdated.
+    See services.payload_cache
+    """
+    __tablename__ = "payload_version"
+
+    PLAYERS = "players"
+    GAME_VALUES = "game-values"
+
+    name: str = db.Column(db.String(32), primary_key=True)
+    version: int = db.Column(db.Integer, nullable=False)
+
+    @staticmethod
+    def get_version(name: str) -> Optional[int]:
+        sql = text("SELECT version FROM payload_version WHERE name = :name;")
+        return db.engine.execute(sql, name=name).scalar()
+
+    @staticmethod
+    def increment(name: str) -> None:
+        """Must be committed by the caller, along with the actual change"""
+        sql = text("UPDATE payload_version SET version = version + 1 WHERE name = :name;")
+        db.session.execute(sql, {"name": name})
+
+
 if 'models.tournament_scheduler_models' not in sys.modules:
     from models.tournament_scheduler_models import Participant, Registration, Schedule, TimeSlot
@@ -1,7 +1,10 @@
 from __future__ import annotations
-from models.core_models import db, Player
-from sqlalchemy import orm
-from typing import Optional, Union
+from models.core_models import db, PayloadVersion, Player
+from sqlalchemy import and_, or_, orm
+from sqlalchemy.dialects.mysql import insert
+from typing import Dict, List, Optional, Tuple, Union
+
+SECONDS_PER_HOUR = 3600
 
 
 class GameValues(db.Model):
@@ -14,6 +17,15 @@ class GameValues(db.Model):
     wr_time: int = db.Column(db.Integer, nullable=False)
     wr_points: int = db.Column(db.Integer, nullable=False)
     mean_time: int = db.Column(db.Integer, nullable=False)
+    # Stored rather than computed so that it can be indexed for sorting
+    wr_points_per_hour: int = db.Column(db.Integer, nullable=False, default=0)
+
+    # Columns that game values can be sorted by, using their DTO name
+    SORTABLE_COLUMNS = {
+        'wrPoints': 'wr_points',
+        'wrTime': 'wr_time',
+        'wrPointsPerHour': 'wr_points_per_hour',
+    }
 
     @staticmethod
     def create_or_update(
@@ -32,9 +44,47 @@ class GameValues(db.Model):
         existing_game_values.wr_points = wr_points
         existing_game_values.mean_time = mean_time
         existing_game_values.run_id = run_id
+        existing_game_values.wr_points_per_hour = GameValues.get_wr_points_per_hour(wr_points, wr_time)
+        PayloadVersion.increment(PayloadVersion.GAME_VALUES)
         db.session.commit()
         return existing_game_values
 
+    @staticmethod
+    def create_or_update_many(game_values: List[GameValues]) -> None:
+        """
+        Creates or updates all the game values in a single `INSERT ... ON DUPLICATE KEY UPDATE` statement.
+        If a game category is present more than once (ie: subcategories), the one worth the most points is kept.
+        """
+        unique_game_values: Dict[Tuple[str, str], GameValues] = {}
+        for game_value in game_values:
+            key = (game_value.game_id, game_value.category_id)
+            existing_game_value = unique_game_values.get(key)
+            if existing_game_value is None or game_value.wr_points > existing_game_value.wr_points:
+                unique_game_values[key] = game_value
+        if not unique_game_values:
+            return
+
+        insert_statement = insert(GameValues).values([{
+            'game_id': game_value.game_id,
+            'category_id': game_value.category_id,
+            'platform_id': game_value.platform_id,
+            'wr_time': game_value.wr_time,
+            'wr_points': game_value.wr_points,
+            'mean_time': game_value.mean_time,
+            'run_id': game_value.run_id,
+            'wr_points_per_hour': GameValues.get_wr_points_per_hour(game_value.wr_points, game_value.wr_time),
+        } for game_value in unique_game_values.values()])
+        db.session.execute(insert_statement.on_duplicate_key_update(
+            platform_id=insert_statement.inserted.platform_id,
+            wr_time=insert_statement.inserted.wr_time,
+            wr_points=insert_statement.inserted.wr_points,
+            mean_time=insert_statement.inserted.mean_time,
+            run_id=insert_statement.inserted.run_id,
+            wr_points_per_hour=insert_statement.inserted.wr_points_per_hour,
+        ))
+        PayloadVersion.increment(PayloadVersion.GAME_VALUES)
+        db.session.commit()
+
     @staticmethod
     def create(
             game_id: str,
@@ -51,8 +101,10 @@ class GameValues(db.Model):
             wr_time=wr_time,
             wr_points=wr_points,
             mean_time=mean_time,
-            run_id=run_id)
+            run_id=run_id,
+            wr_points_per_hour=GameValues.get_wr_points_per_hour(wr_points, wr_time))
         db.session.add(game_values)
+        PayloadVersion.increment(PayloadVersion.GAME_VALUES)
         db.session.commit()
 
         return game_values
@@ -68,6 +120,63 @@ class GameValues(db.Model):
         except orm.exc.NoResultFound:
             return None
 
+    @staticmethod
+    def search(
+            platform_ids: List[str],
+            game_ids: List[str],
+            category_ids: List[str],
+            wr_time_range: Tuple[Optional[int], Optional[int]],
+            mean_time_range: Tuple[Optional[int], Optional[int]],
+            wr_points_range: Tuple[Optional[int], Optional[int]],
+            order_by: str,
+            descending: bool,
+            limit: int,
+            after: Optional[Tuple[int, str, str]] = None) -> List[GameValues]:
+        """
+        Returns a single page of game values, sorted by "order_by" (one of SORTABLE_COLUMNS) then by their key.
+        Game values of any of "game_ids" or of any of "category_ids" match, all of them if both are empty.
+        Ranges are inclusive, None meaning unbounded.
+        "after" is the sorted value, game_id and category_id of the last game value of the previous page.
+        """
+        order_column = getattr(GameValues, GameValues.SORTABLE_COLUMNS[order_by])
+        query = GameValues.query
+        if platform_ids:
+            query = query.filter(GameValues.platform_id.in_(platform_ids))
+        if game_ids or category_ids:
+            query = query.filter(or_(GameValues.game_id.in_(game_ids), GameValues.category_id.in_(category_ids)))
+        ranges = (
+            (GameValues.wr_time, wr_time_range),
+            (GameValues.mean_time, mean_time_range),
+            (GameValues.wr_points, wr_points_range))
+        for column, (minimum, maximum) in ranges:
+            if minimum is not None:
+                query = query.filter(column >= minimum)
+            if maximum is not None:
+                query = query.filter(column <= maximum)
+
+        # Keyset pagination: continue right after the last row instead of skipping an offset, so that the database
+        # can seek directly to it in the matching ([platform_id,] sorted column, game_id, category_id) index
+        if after is not None:
+            after_value, after_game_id, after_category_id = after
+
+            def is_past(column: db.Column, value: Union[int, str]):
+                return column < value if descending else column > value
+            query = query.filter(or_(
+                is_past(order_column, after_value),
+                and_(order_column == after_value, or_(
+                    is_past(GameValues.game_id, after_game_id),
+                    and_(GameValues.game_id == after_game_id, is_past(GameValues.category_id, after_category_id))))))
+
+        sort_columns = (order_column, GameValues.game_id, GameValues.category_id)
+        return query \
+            .order_by(*(column.desc() if descending else column.asc() for column in sort_columns)) \
+            .limit(limit) \
+            .all()
+
+    @staticmethod
+    def get_wr_points_per_hour(wr_points: int, wr_time: int) -> int:
+        return wr_points * SECONDS_PER_HOUR // max(wr_time, 1)
+
     def to_dto(self) -> dict[str, Union[str, int, None]]:
         return {
             'gameId': self.game_id,
@@ -1,72 +1,958 @@
 from __future__ import annotations
+from array import array
+from collections import deque
+from copy import copy
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from math import ceil, floor
-from services.utils import get_file, map_to_dto, UserUpdaterError
-from typing import Dict, List, Optional, Union
+from models.core_models import db
+from services.caching import BoundedTTLCache, SingleFlight
+from services.update_context import get_current_update_context, UpdateContext
+from services.utils import canonicalize_url, circuit_breaker, get_file, get_file_if_modified, map_to_dto, \
+    ResponseValidators, run_in_thread_pool, UnderALotOfPressure, UserUpdaterError
+from sqlalchemy import exc, text
+from threading import Lock
+from typing import Deque, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 from urllib import parse
 import configs
+import hashlib
+import json
+import sys
+import uuid
 
-memoized_requests: Dict[str, SrcRequest] = {}
+CACHED_REQUEST_URL_MAX_LENGTH = 255  # Max for mysql 5.6
+# Additive increase of the page size after each page that worked, see PaginationCheckpoint
+PAGE_SIZE_INCREASE = 20
+# How much bigger a parsed speedrun.com response is than its JSON. Measured between 4.5x and 6x on runs and leaderboards
+PARSED_RESPONSE_SIZE_FACTOR = 6
+
+memoized_requests: BoundedTTLCache[SrcRequest] = BoundedTTLCache(
+    configs.request_cache_max_megabytes * 1024 * 1024,
+    timedelta(days=configs.last_updated_days[0]))
+requests_in_flight: SingleFlight[SrcRequest] = SingleFlight()
+compact_leaderboards: BoundedTTLCache[CompactLeaderboard] = BoundedTTLCache(
+    configs.leaderboards_cache_max_megabytes * 1024 * 1024,
+    timedelta(days=configs.last_updated_days[0]))
+leaderboards_in_flight: SingleFlight[CompactLeaderboard] = SingleFlight()
+scored_leaderboards: BoundedTTLCache[ScoredLeaderboard] = BoundedTTLCache(
+    configs.scored_leaderboards_cache_max_megabytes * 1024 * 1024,
+    timedelta(days=configs.last_updated_days[0]))
+game_metadata: BoundedTTLCache[GameMetadata] = BoundedTTLCache(
+    configs.game_metadata_cache_max_megabytes * 1024 * 1024,
+    timedelta(days=configs.game_metadata_cache_days))
+game_metadata_in_flight: SingleFlight[GameMetadata] = SingleFlight()
+pagination_checkpoints: BoundedTTLCache[PaginationCheckpoint] = BoundedTTLCache(
+    configs.pagination_checkpoints_cache_max_megabytes * 1024 * 1024,
+    timedelta(minutes=configs.pagination_checkpoint_minutes))
+
+
+class PersistedRequest(NamedTuple):
+    """A row of the cached_request table"""
+    serialized_result: str
+    timestamp: datetime
+    validators: ResponseValidators
+    # Hash of "serialized_result", to tell if the content changed when speedrun.com doesn't give validators
+    body_hash: Optional[str]
+    # Expired, but speedrun.com couldn't be reached to revalidate it (see services.circuit_breaker)
+    is_stale: bool = False
 
 
 class SrcRequest():
-    global memoized_requests
     result: dict
     timestamp: datetime
+    # See PersistedRequest.is_stale
+    is_stale: bool
 
-    def __init__(self, result: dict, timestamp: datetime):
+    def __init__(self, result: dict, timestamp: datetime, is_stale: bool = False):
         self.result = result
         self.timestamp = timestamp
+        self.is_stale = is_stale
 
     @staticmethod
     def get_cached_response_or_new(url: str) -> dict:
-        today = datetime.utcnow()
-        yesterday = today - timedelta(days=configs.last_updated_days[0])
+        return SrcRequest.get_cached_request_or_new(url).result
+
+    @staticmethod
+    def get_cached_request_or_new(url: str) -> SrcRequest:
+        """Same as get_cached_response_or_new, but also gives access to when the response was obtained"""
+        url = canonicalize_url(url)
+
+        # First look in this process' memory ...
+        cached_request = memoized_requests.get(url)
+        if cached_request:
+            return cached_request
+
+        # If another thread is already looking for the same url, wait for its result instead
+        return requests_in_flight.do(url, lambda: SrcRequest._load_persisted_or_new(url))
+
+    @staticmethod
+    def _load_persisted_or_new(url: str) -> SrcRequest:
+        yesterday = datetime.utcnow() - timedelta(days=configs.last_updated_days[0])
+
+        # The thread that was fetching this url may have finished between our lookup and now
+        cached_request = memoized_requests.get(url)
+        if cached_request:
+            return cached_request
+
+        # ... then look in the database, which is shared by every worker and survives restarts,
+        # and only then ask speedrun.com
+        try:
+            persisted_request, result = SrcRequest._load_persisted_or_revalidate(url, yesterday)
+        except UnderALotOfPressure:
+            # Not persisted (ie: the url is too long), but it may still be in memory
+            expired_request = memoized_requests.get_stale(url)
+            if expired_request is None:
+                raise
+            print(f"WARNING: speedrun.com is unavailable, using the expired response for {url}")
+            return SrcRequest(expired_request.result, expired_request.timestamp, True)
+        cached_request = SrcRequest(
+            json.loads(persisted_request.serialized_result) if result is None else result,
+            persisted_request.timestamp,
+            persisted_request.is_stale)
+        # A stale request keeps its old timestamp, so it's still expired and revalidated once speedrun.com is back
+        memoized_requests.set(
+            url,
+            cached_request,
+            len(persisted_request.serialized_result) * PARSED_RESPONSE_SIZE_FACTOR,
+            persisted_request.timestamp)
+        return cached_request
 
+    @staticmethod
+    def _load_persisted_or_revalidate(url: str, expiry: datetime) -> Tuple[PersistedRequest, Optional[dict]]:
+        """
+        Returns the persisted request if it was obtained after "expiry", otherwise revalidates it (see _revalidate).
+        Also returns the new result, or None if it can be parsed from the persisted request.
+        While speedrun.com is unavailable, the expired persisted request is returned as stale instead.
+        """
+        persisted_request = SrcRequest._load_persisted(url)
+        if persisted_request and persisted_request.timestamp >= expiry:
+            return persisted_request, None
         try:
-            cached_request = memoized_requests[url]
-        except KeyError:
-            cached_request = None
-        if (cached_request and cached_request.timestamp >= yesterday):
-            return cached_request.result
+            return SrcRequest._revalidate(url, persisted_request, datetime.utcnow())
+        except UnderALotOfPressure:
+            if persisted_request is None:
+                raise
+            print(f"WARNING: speedrun.com is unavailable, using the expired response for {url}")
+            return persisted_request._replace(is_stale=True), None
+
+    @staticmethod
+    def _revalidate(
+            url: str,
+            persisted_request: Optional[PersistedRequest],
+            timestamp: datetime) -> Tuple[PersistedRequest, Optional[dict]]:
+        """
+        Asks speedrun.com for "url", but only for the content if it changed since "persisted_request".
+        If the content is the same (as told by speedrun.com, or by its hash), only its timestamp is refreshed.
+        Returns the up to date persisted request, and the new result, or None if it didn't change.
+        """
+        result, validators = get_file_if_modified(url, persisted_request.validators if persisted_request else None)
+        if result is None and persisted_request:
+            serialized_result = persisted_request.serialized_result
         else:
-            result = get_file(url)
-            memoized_requests[url] = SrcRequest(result, today)
-            return result
+            serialized_result = json.dumps(result)
+        body_hash = SrcRequest._get_body_hash(serialized_result)
+        up_to_date_request = PersistedRequest(serialized_result, timestamp, validators, body_hash)
+
+        if persisted_request and persisted_request.body_hash == body_hash:
+            SrcRequest._refresh_persisted(url, timestamp, validators)
+            return up_to_date_request, None
+        SrcRequest._persist(url, up_to_date_request)
+        return up_to_date_request, result
+
+    @staticmethod
+    def _get_body_hash(serialized_result: str) -> str:
+        return hashlib.sha1(serialized_result.encode()).hexdigest()
+
+    @staticmethod
+    def _load_persisted(url: str) -> Optional[PersistedRequest]:
+        """Expired requests are also returned, so they can be revalidated"""
+        if len(url) > CACHED_REQUEST_URL_MAX_LENGTH:
+            return None
+        sql = text("SELECT result, timestamp, etag, last_modified, body_hash FROM cached_request "
+                   "WHERE url = :url;")
+        try:
+            cached_request = db.engine.execute(sql, url=url).fetchone()
+        # The database is only a cache here, failing to reach it shouldn't fail the update
+        except exc.SQLAlchemyError as exception:
+            print(f"WARNING: Couldn't read cached request for {url}: {exception}")
+            return None
+        if not cached_request:
+            return None
+        return PersistedRequest(
+            cached_request[0],
+            cached_request[1],
+            ResponseValidators(cached_request[2], cached_request[3]),
+            cached_request[4])
+
+    @staticmethod
+    def _persist(url: str, persisted_request: PersistedRequest) -> None:
+        if len(url) > CACHED_REQUEST_URL_MAX_LENGTH:
+            return
+        sql = text("INSERT INTO cached_request (url, timestamp, result, etag, last_modified, body_hash) "
+                   "VALUES (:url, :timestamp, :result, :etag, :last_modified, :body_hash) "
+                   "ON DUPLICATE KEY UPDATE timestamp = VALUES(timestamp), result = VALUES(result), "
+                   "etag = VALUES(etag), last_modified = VALUES(last_modified), body_hash = VALUES(body_hash);")
+        try:
+            db.engine.execute(
+                sql,
+                url=url,
+                timestamp=persisted_request.timestamp,
+                result=persisted_request.serialized_result,
+                etag=persisted_request.validators.etag,
+                last_modified=persisted_request.validators.last_modified,
+                body_hash=persisted_request.body_hash)
+        except exc.SQLAlchemyError as exception:
+            print(f"WARNING: Couldn't cache request for {url}: {exception}")
+
+    @staticmethod
+    def _refresh_persisted(url: str, timestamp: datetime, validators: ResponseValidators) -> None:
+        """Marks the persisted request as still up to date, without rewriting its result"""
+        if len(url) > CACHED_REQUEST_URL_MAX_LENGTH:
+            return
+        sql = text("UPDATE cached_request SET timestamp = :timestamp, etag = :etag, last_modified = :last_modified "
+                   "WHERE url = :url;")
+        try:
+            db.engine.execute(
+                sql,
+                url=url,
+                timestamp=timestamp,
+                etag=validators.etag,
+                last_modified=validators.last_modified)
+        except exc.SQLAlchemyError as exception:
+            print(f"WARNING: Couldn't refresh cached request for {url}: {exception}")
+
+    @staticmethod
+    def purge_expired() -> int:
+        """
+        Removes the cached requests older than configs.last_updated_days[1]. Returns the amount removed.
+        Requests older than configs.last_updated_days[0] are only kept to be revalidated.
+        """
+        expiry = datetime.utcnow() - timedelta(days=configs.last_updated_days[1])
+        sql = text("DELETE FROM cached_request WHERE timestamp < :expiry;")
+        return db.engine.execute(sql, expiry=expiry).rowcount
 
     @staticmethod
     def get_paginated_response(url: str) -> dict:
         summed_results = {"data": []}
-        next_url = url
-        while next_url:
-            max_param = parse.parse_qs(parse.urlparse(next_url).query).get('max')
-            results_per_page = int(max_param[0]) if max_param else 20
-
-            # Get the next page of results ...
-            while True:
-                try:
-                    result = get_file(next_url)
-                    break
-                # If it failed, try again with a smaller page.
-                # The usual suspects:
-                # - Otterstone_Gamer, qjn1wzw8 --> /6 (400-433) still fails
-                # - Cmdr, 48g5vo7j
-                # - SRGTsilent, v8l3eq48
-                except UserUpdaterError as exception:
-                    if exception.args[0]['error'] != "HTTPError 500" or results_per_page < 20:
-                        raise exception
-                    reduced_results_per_page = floor(results_per_page / 7)
-                    print("SRC returned 500 for a paginated request. "
-                          f"Reducing the max results per page from {results_per_page} to {reduced_results_per_page}")
-                    next_url = next_url.replace(f"max={results_per_page}", f"max={reduced_results_per_page}")
-                    results_per_page = reduced_results_per_page
-
-            # ... and combine it with previous ones
-            next_url = next((link["uri"] for link in result["pagination"]["links"] if link["rel"] == "next"), None)
-            summed_results["data"] += result["data"]
-
+        for page in SrcRequest.iterate_paginated_response(url):
+            summed_results["data"] += page
         return summed_results
 
+    @staticmethod
+    def iterate_paginated_response(url: str) -> Iterator[List[dict]]:
+        """
+        Yields the "data" of every page as soon as it's received, so it can be processed before the next one.
+        If a previous walk of the same url failed recently, resumes from its PaginationCheckpoint.
+        The checkpoint is only shared once the walk failed, so concurrent walks of the same url never share one.
+        """
+        url = canonicalize_url(url)
+        # Only one walk can resume it
+        checkpoint = pagination_checkpoints.pop(url)
+        if not checkpoint:
+            max_param = parse.parse_qs(parse.urlparse(url).query).get('max')
+            checkpoint = PaginationCheckpoint(int(max_param[0]) if max_param else 20)
+
+        try:
+            if checkpoint.pages:
+                print(f"Resuming {url} from its {len(checkpoint.pages)} already fetched pages")
+                yield from list(checkpoint.pages)
+            while not checkpoint.is_done:
+                result = SrcRequest._get_page_or_smaller(url, checkpoint)
+                checkpoint.add_page(result)
+                yield result["data"]
+
+                # Once back to the full page size, the offsets of the next pages can be guessed and fetched concurrently
+                if not checkpoint.is_done \
+                        and checkpoint.page_size == checkpoint.max_page_size \
+                        and configs.max_prefetched_pages > 1:
+                    yield from SrcRequest._iterate_prefetched_pages(url, checkpoint)
+        # Keep what was fetched so far for the next walk of this url.
+        # Stopping early on purpose (GeneratorExit, ie: incremental updates) leaves nothing to resume.
+        except Exception:
+            pagination_checkpoints.set(url, checkpoint, checkpoint.get_approximate_size(), checkpoint.timestamp)
+            raise
+
+    @staticmethod
+    def _get_page_or_smaller(url: str, checkpoint: PaginationCheckpoint) -> dict:
+        while True:
+            try:
+                return get_file(SrcRequest._get_page_url(url, checkpoint.offset, checkpoint.page_size))
+            # If it failed, try again with a smaller page.
+            # The usual suspects:
+            # - Otterstone_Gamer, qjn1wzw8 --> /6 (400-433) still fails
+            # - Cmdr, 48g5vo7j
+            # - SRGTsilent, v8l3eq48
+            except UserUpdaterError as exception:
+                if exception.args[0]['error'] != "HTTPError 500" or checkpoint.page_size < 20:
+                    raise exception
+                reduced_page_size = floor(checkpoint.page_size / 7)
+                print("SRC returned 500 for a paginated request. "
+                      f"Reducing the max results per page from {checkpoint.page_size} to {reduced_page_size}")
+                checkpoint.page_size = reduced_page_size
+
+    @staticmethod
+    def _iterate_prefetched_pages(url: str, checkpoint: PaginationCheckpoint) -> Iterator[List[dict]]:
+        """
+        Fetches the next pages concurrently by offset, and yields their "data" in order.
+        The amount of pages requested ahead doubles with every full page, up to configs.max_prefetched_pages,
+        so that runners with only a couple pages don't waste requests past the last one.
+        Stops once done, or to let iterate_paginated_response continue from the checkpoint one page at a time
+        (ie: to shrink the page size).
+        """
+        page_size = checkpoint.page_size
+        next_offset = checkpoint.offset
+        prefetch_size = 1
+        prefetched_pages: Deque[Future] = deque()
+        # Cancelled once the walk is over, so that the pages past the last one that haven't been requested yet
+        # (ie: still waiting for the rate limiter) never are. Also cancelled along with the current update, if any.
+        current_context = get_current_update_context()
+        walk_context = current_context.create_child() if current_context else UpdateContext()
+
+        def get_prefetched_page(page_url: str) -> dict:
+            with walk_context.activated():
+                # Goes through get_file, so these still count towards the rate limit
+                return get_file(page_url)
+
+        with ThreadPoolExecutor(configs.max_prefetched_pages) as executor:
+            try:
+                while True:
+                    while len(prefetched_pages) < prefetch_size:
+                        page_url = SrcRequest._get_page_url(url, next_offset, page_size)
+                        prefetched_pages.append(executor.submit(get_prefetched_page, page_url))
+                        next_offset += page_size
+
+                    try:
+                        result = prefetched_pages.popleft().result()
+                    except UserUpdaterError as exception:
+                        if exception.args[0]['error'] != "HTTPError 500":
+                            raise exception
+                        return
+                    checkpoint.add_page(result)
+                    yield result["data"]
+
+                    # Either the last page, or speedrun.com didn't give a full page and the guessed offsets are off
+                    if checkpoint.is_done or result["pagination"]["size"] < page_size:
+                        return
+                    prefetch_size = min(prefetch_size * 2, configs.max_prefetched_pages)
+            finally:
+                walk_context.cancel()
+                for prefetched_page in prefetched_pages:
+                    prefetched_page.cancel()
+
+    @staticmethod
+    def _get_next_page_url(result: dict) -> Optional[str]:
+        return next((link["uri"] for link in result["pagination"]["links"] if link["rel"] == "next"), None)
+
+    @staticmethod
+    def _get_page_url(url: str, offset: int, page_size: int) -> str:
+        parsed_url = parse.urlparse(url)
+        query = parse.parse_qs(parsed_url.query)
+        query["offset"] = [str(offset)]
+        query["max"] = [str(page_size)]
+        return parsed_url._replace(query=parse.urlencode(query, doseq=True, safe=",")).geturl()
+
+
+class PaginationCheckpoint:
+    """
+    Progress of a paginated request, kept until it's done so a failed update can resume it later.
+    The page size is shrunk when speedrun.com fails to give a page and grows back AIMD style.
+    """
+    # Every page fetched so far, in order
+    pages: List[List[dict]]
+    # Amount of results fetched so far
+    offset: int
+    # Last page size that worked
+    page_size: int
+    max_page_size: int
+    is_done: bool
+    timestamp: datetime
+
+    def __init__(self, max_page_size: int) -> None:
+        self.pages = []
+        self.offset = 0
+        self.page_size = max_page_size
+        self.max_page_size = max_page_size
+        self.is_done = False
+        self.timestamp = datetime.utcnow()
+
+    def add_page(self, result: dict) -> None:
+        self.pages.append(result["data"])
+        self.offset += len(result["data"])
+        self.is_done = SrcRequest._get_next_page_url(result) is None
+        self.page_size = min(self.page_size + PAGE_SIZE_INCREASE, self.max_page_size)
+        self.timestamp = datetime.utcnow()
+
+    def get_approximate_size(self) -> int:
+        # A run without embeds is usually under 1KB once parsed
+        return 1024 * self.offset + 512
+
+
+class UpdateJob(db.Model):
+    """
+    Tracks a user update running in the background.
+    Kept in the database so that any webworker can answer about the progress of any job.
+    """
+    __tablename__ = "update_job"
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+
+    job_id: str = db.Column(db.String(36), primary_key=True)
+    name_or_id: str = db.Column(db.String(64), nullable=False)
+    status: str = db.Column(db.String(8), nullable=False)
+    progress_done: int = db.Column(db.Integer, nullable=False, default=0)
+    progress_total: Optional[int] = db.Column(db.Integer)
+    # The HTTP status code and body the update would have answered with had it been synchronous
+    status_code: Optional[int] = db.Column(db.Integer)
+    result: Optional[str] = db.Column(db.Text)
+    created_at: datetime = db.Column(db.DateTime, nullable=False)
+    updated_at: datetime = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def create(name_or_id: str) -> UpdateJob:
+        now = datetime.utcnow()
+        update_job = UpdateJob(
+            job_id=str(uuid.uuid4()),
+            name_or_id=name_or_id,
+            status=UpdateJob.STATUS_QUEUED,
+            progress_done=0,
+            created_at=now,
+            updated_at=now)
+        db.session.add(update_job)
+        db.session.commit()
+
+        return update_job
+
+    @staticmethod
+    def get(job_id: str) -> Optional[UpdateJob]:
+        return UpdateJob.query.get(job_id)
+
+    @staticmethod
+    def update_by_id(job_id: str, **kwargs: Union[Optional[str], int]) -> None:
+        UpdateJob \
+            .query \
+            .filter(UpdateJob.job_id == job_id) \
+            .update({**kwargs, 'updated_at': datetime.utcnow()})
+        db.session.commit()
+
+    @staticmethod
+    def update_progress(job_id: str, progress_done: int, progress_total: int) -> None:
+        """Can be called from any thread as it doesn't go through the thread's session"""
+        sql = text("UPDATE update_job "
+                   "SET progress_done = :progress_done, progress_total = :progress_total, updated_at = :updated_at "
+                   "WHERE job_id = :job_id;")
+        try:
+            db.engine.execute(
+                sql,
+                job_id=job_id,
+                progress_done=progress_done,
+                progress_total=progress_total,
+                updated_at=datetime.utcnow())
+        # The progress is only informative, it shouldn't fail the update (ie: no connection left in the pool)
+        except exc.SQLAlchemyError as exception:
+            print(f"WARNING: Couldn't save the progress of update job {job_id}: {exception}")
+
+    @staticmethod
+    def purge_finished(older_than: timedelta) -> int:
+        """Removes the finished jobs that haven't been updated since "older_than". Returns the amount removed."""
+        sql = text("DELETE FROM update_job WHERE status IN (:done, :failed) AND updated_at < :expiry;")
+        return db.engine.execute(
+            sql,
+            done=UpdateJob.STATUS_DONE,
+            failed=UpdateJob.STATUS_FAILED,
+            expiry=datetime.utcnow() - older_than).rowcount
+
+    def is_finished(self) -> bool:
+        return self.status in (UpdateJob.STATUS_DONE, UpdateJob.STATUS_FAILED)
+
+    def is_abandoned(self, timeout: timedelta) -> bool:
+        """Jobs only run in the worker that created them, they're lost if it restarts before they're done"""
+        return not self.is_finished() and self.updated_at < datetime.utcnow() - timeout
+
+    def to_dto(self) -> dict[str, Union[str, int, None, dict[str, Optional[int]]]]:
+        return {
+            'jobId': self.job_id,
+            'nameOrId': self.name_or_id,
+            'status': self.status,
+            'progress': {
+                'done': self.progress_done,
+                'total': self.progress_total,
+            },
+        }
+
+
+class PlayerRunScore(db.Model):
+    """
+    The points given by each of a player's personal bests, replaced in full on every update.
+    Personal bests that aren't counted towards the score are kept too, so that the next update can be incremental.
+    Supersedes Player.score_details, which is only kept for players that haven't been updated since.
+    """
+    __tablename__ = "player_run_score"
+
+    # DTO field name to column name
+    DTO_FIELDS = {
+        'runId': 'run_id',
+        'gameId': 'game_id',
+        'gameName': 'game_name',
+        'categoryId': 'category_id',
+        'categoryName': 'category_name',
+        'levelId': 'level_id',
+        'levelName': 'level_name',
+        'points': 'points',
+        'levelFraction': 'level_fraction',
+        'isTopRun': 'is_top_run',
+    }
+    # Same fields as Run.to_dto
+    DEFAULT_DTO_FIELDS = ['gameName', 'categoryName', 'levelName', 'points', 'levelFraction']
+
+    player_id: str = db.Column(
+        db.String(8),
+        db.ForeignKey('player.user_id', ondelete="CASCADE"),
+        primary_key=True)
+    run_id: str = db.Column(db.String(8), primary_key=True)
+    game_id: str = db.Column(db.String(8), nullable=False)
+    game_name: str = db.Column(db.String(128), nullable=False)
+    category_id: str = db.Column(db.String(8), nullable=False)
+    category_name: str = db.Column(db.String(128), nullable=False)
+    level_id: str = db.Column(db.String(8), nullable=False)
+    level_name: str = db.Column(db.String(128), nullable=False)
+    # Subcategory variable ids to value ids, as JSON
+    variables: str = db.Column(db.String(1024), nullable=False, default="{}")
+    platform_id: Optional[str] = db.Column(db.String(8))
+    primary_t: float = db.Column(db.Float(53), nullable=False, default=0)
+    points: float = db.Column(db.Float(53), nullable=False)
+    level_fraction: float = db.Column(db.Float(53), nullable=False)
+    # Whether the run is in the top runs or in the lesser runs
+    is_counted: bool = db.Column(db.Boolean, nullable=False, default=True)
+    # Whether the run is part of the top 60 that make up the player's score
+    is_top_run: bool = db.Column(db.Boolean, nullable=False)
+    # Order of the run in the top runs, the lesser runs, or the runs that aren't counted
+    position: int = db.Column(db.Integer, nullable=False)
+
+    @staticmethod
+    def replace_for_player(player_id: str, points_distribution: List[List[Run]], personal_bests: List[Run]) -> None:
+        """
+        Replaces all of the player's run scores using one delete and one multi-row insert.
+        "personal_bests" should include every run of "points_distribution".
+        Also commits the player's pending changes, see update_runner_in_database.
+        """
+        db.session.execute(PlayerRunScore.__table__.delete().where(PlayerRunScore.player_id == player_id))
+        counted_run_ids = {run.id_ for runs in points_distribution for run in runs}
+        top_runs, lesser_runs = points_distribution
+        # is_counted, is_top_run, runs
+        run_groups = (
+            (True, True, top_runs),
+            (True, False, lesser_runs),
+            (False, False, [run for run in personal_bests if run.id_ not in counted_run_ids]),
+        )
+        run_scores = [{
+            'player_id': player_id,
+            'run_id': run.id_,
+            'game_id': run.game,
+            'game_name': run.game_name,
+            'category_id': run.category,
+            'category_name': run.category_name,
+            'level_id': run.level,
+            'level_name': run.level_name,
+            'variables': json.dumps(run.variables, sort_keys=True),
+            'platform_id': run.platform,
+            'primary_t': run.primary_t,
+            'points': run._points,
+            'level_fraction': run.level_fraction,
+            'is_counted': is_counted,
+            'is_top_run': is_top_run,
+            'position': position,
+        } for is_counted, is_top_run, runs in run_groups for position, run in enumerate(runs)]
+        if run_scores:
+            db.session.execute(PlayerRunScore.__table__.insert().values(run_scores))
+        db.session.commit()
+
+    @staticmethod
+    def exists_for_player(player_id: str) -> bool:
+        """Whether the player has been updated since run scores are stored, even if none of them is counted"""
+        return db.session.query(PlayerRunScore.query.filter(PlayerRunScore.player_id == player_id).exists()).scalar()
+
+    @staticmethod
+    def get_for_player(player_id: str, limit: Optional[int] = None) -> List[PlayerRunScore]:
+        """The player's top runs, then lesser runs, each in order. "limit" applies to each of the two lists."""
+        query = PlayerRunScore.query.filter(PlayerRunScore.player_id == player_id, PlayerRunScore.is_counted)
+        if limit is not None:
+            query = query.filter(PlayerRunScore.position < limit)
+        return query \
+            .order_by(PlayerRunScore.is_top_run.desc(), PlayerRunScore.position) \
+            .all()
+
+    @staticmethod
+    def get_personal_bests(player_id: str) -> List[Run]:
+        """Every personal best stored by the player's last update, counted runs first, as they were scored then"""
+        return [run_score.to_run() for run_score in PlayerRunScore.query
+                .filter(PlayerRunScore.player_id == player_id)
+                .order_by(PlayerRunScore.is_counted.desc(),
+                          PlayerRunScore.is_top_run.desc(),
+                          PlayerRunScore.position)
+                .all()]
+
+    def to_run(self) -> Run:
+        run = Run(self.run_id,
+                  self.primary_t,
+                  self.game_id,
+                  self.game_name,
+                  self.category_id,
+                  json.loads(self.variables),
+                  self.level_id,
+                  self.level_name)
+        run.level_fraction = self.level_fraction
+        run.platform = self.platform_id
+        run.category_name = self.category_name
+        run._points = self.points
+        return run
+
+    def to_dto(self, fields: Optional[List[str]] = None) -> dict[str, Union[str, float, bool]]:
+        return {
+            field: getattr(self, PlayerRunScore.DTO_FIELDS[field])
+            for field in fields or PlayerRunScore.DEFAULT_DTO_FIELDS
+        }
+
+
+class BannedPlayer(db.Model):
+    """Speedrun.com users known to be banned, so that leaderboards don't have to embed their players"""
+    __tablename__ = "banned_player"
+
+    user_id: str = db.Column(db.String(8), primary_key=True)
+    detected_at: datetime = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def get_all_ids() -> List[str]:
+        """Can be called from any thread as it doesn't go through the thread's session"""
+        return [banned_player[0] for banned_player in db.engine.execute(
+            text("SELECT user_id FROM banned_player;")).fetchall()]
+
+    @staticmethod
+    def set_banned(user_id: str, is_banned: bool) -> None:
+        """Can be called from any thread as it doesn't go through the thread's session"""
+        if is_banned:
+            db.engine.execute(
+                text("INSERT IGNORE INTO banned_player (user_id, detected_at) VALUES (:user_id, :detected_at);"),
+                user_id=user_id,
+                detected_at=datetime.utcnow())
+        else:
+            db.engine.execute(text("DELETE FROM banned_player WHERE user_id = :user_id;"), user_id=user_id)
+
+
+class BannedPlayerRegistry:
+    """
+    In-memory copy of the BannedPlayer ids, meant to be shared by every thread of the process.
+    Reloaded every "refresh_interval" to get the banned players found by other workers and scheduled tasks.
+    """
+
+    def __init__(self, refresh_interval: timedelta) -> None:
+        self.refresh_interval = refresh_interval
+        self._ids: FrozenSet[str] = frozenset()
+        self._loaded_at: Optional[datetime] = None
+        self._lock = Lock()
+
+    def get_ids(self) -> FrozenSet[str]:
+        with self._lock:
+            if self._loaded_at is None or self._loaded_at < datetime.utcnow() - self.refresh_interval:
+                self.__reload()
+            return self._ids
+
+    def set_banned(self, user_id: str, is_banned: bool) -> None:
+        """Only writes to the database if it's not already known"""
+        if (user_id in self.get_ids()) == is_banned:
+            return
+        try:
+            BannedPlayer.set_banned(user_id, is_banned)
+        except exc.SQLAlchemyError as exception:
+            print(f"WARNING: Couldn't save whether {user_id} is banned: {exception}")
+        with self._lock:
+            self._ids = (self._ids | {user_id}) if is_banned else (self._ids - {user_id})
+
+    def __reload(self) -> None:
+        try:
+            self._ids = frozenset(BannedPlayer.get_all_ids())
+        # Keep using the last known banned players until the database can be reached again
+        except exc.SQLAlchemyError as exception:
+            print(f"WARNING: Couldn't load the banned players: {exception}")
+        self._loaded_at = datetime.utcnow()
+
+
+banned_players = BannedPlayerRegistry(timedelta(minutes=configs.banned_players_refresh_minutes))
+
+
+class CircuitBreakerState(db.Model):
+    """Until when services.utils.circuit_breaker stops all requests to speedrun.com, shared by every worker"""
+    __tablename__ = "circuit_breaker"
+
+    name: str = db.Column(db.String(32), primary_key=True)
+    open_until: datetime = db.Column(db.DateTime, nullable=False)
+
+    SPEEDRUN_COM = "speedrun.com"
+
+    @staticmethod
+    def get_open_until() -> Optional[datetime]:
+        """Can be called from any thread as it doesn't go through the thread's session"""
+        try:
+            row = db.engine.execute(
+                text("SELECT open_until FROM circuit_breaker WHERE name = :name;"),
+                name=CircuitBreakerState.SPEEDRUN_COM).fetchone()
+        # Each worker can still open its own circuit without the database
+        except exc.SQLAlchemyError as exception:
+            print(f"WARNING: Couldn't load the circuit breaker state: {exception}")
+            return None
+        return row[0] if row else None
+
+    @staticmethod
+    def set_open_until(open_until: datetime) -> None:
+        """Can be called from any thread as it doesn't go through the thread's session"""
+        try:
+            db.engine.execute(
+                text("INSERT INTO circuit_breaker (name, open_until) VALUES (:name, :open_until) "
+                     "ON DUPLICATE KEY UPDATE open_until = GREATEST(open_until, VALUES(open_until));"),
+                name=CircuitBreakerState.SPEEDRUN_COM,
+                open_until=open_until)
+        except exc.SQLAlchemyError as exception:
+            print(f"WARNING: Couldn't save the circuit breaker state: {exception}")
+
+
+circuit_breaker.share_state_with(CircuitBreakerState.get_open_until, CircuitBreakerState.set_open_until)
+
+
+class CompactLeaderboard:
+    """
+    Only what's needed to score a leaderboard, as parallel columns indexed by the position of the run.
+    Takes a lot less memory to cache than the parsed speedrun.com response and its embedded players.
+    """
+    weblink: str
+    timestamp: datetime
+    run_ids: List[str]
+    primary_times: array  # "d"
+    places: array  # "i"
+    has_videos: array  # "b"
+    # The ids of the players of the run at "position" are
+    # player_ids[player_offsets[position]:player_offsets[position + 1]]. Guests don't have an id.
+    player_ids: List[str]
+    player_offsets: array  # "i"
+    # The players of this leaderboard that were known to be banned when it was obtained
+    banned_player_ids: FrozenSet[str]
+    # See SrcRequest._get_body_hash
+    body_hash: Optional[str]
+    # See PersistedRequest.is_stale
+    is_stale: bool = False
+
+    def __init__(
+            self,
+            leaderboard: dict,
+            timestamp: datetime,
+            known_banned_player_ids: FrozenSet[str],
+            body_hash: Optional[str] = None) -> None:
+        """
+        Parses the "data" of a speedrun.com leaderboard response.
+        "known_banned_player_ids" can include players that aren't in this leaderboard, see banned_players.
+        """
+        self.weblink = leaderboard["weblink"]
+        self.timestamp = timestamp
+        self.body_hash = body_hash
+        self.run_ids = []
+        self.primary_times = array("d")
+        self.places = array("i")
+        self.has_videos = array("b")
+        self.player_ids = []
+        self.player_offsets = array("i", [0])
+        for run in leaderboard["runs"]:
+            self.run_ids.append(run["run"]["id"])
+            self.primary_times.append(run["run"]["times"]["primary_t"])
+            self.places.append(run["place"])
+            self.has_videos.append(bool(run["run"].get("videos")))
+            # The same players are found across many leaderboards, no need to keep a copy of their id for each
+            self.player_ids += [sys.intern(player["id"]) for player in run["run"]["players"] if player.get("id")]
+            self.player_offsets.append(len(self.player_ids))
+        self._find_banned_players(known_banned_player_ids)
+
+    def __len__(self) -> int:
+        return len(self.run_ids)
+
+    def _find_banned_players(self, known_banned_player_ids: FrozenSet[str]) -> None:
+        self.banned_player_ids = known_banned_player_ids.intersection(self.player_ids)
+
+    def has_banned_player(self, position: int) -> bool:
+        return not self.banned_player_ids.isdisjoint(
+            self.player_ids[self.player_offsets[position]:self.player_offsets[position + 1]])
+
+    def get_approximate_size(self) -> int:
+        # The player ids are shared with other leaderboards, so only count the references to them
+        return sys.getsizeof(self.run_ids) + sum(sys.getsizeof(run_id) for run_id in self.run_ids) \
+            + sys.getsizeof(self.player_ids) \
+            + sum(sys.getsizeof(column) for column in (
+                self.primary_times, self.places, self.has_videos, self.player_offsets, self.banned_player_ids)) \
+            + sys.getsizeof(self.weblink) + 512
+
+    @staticmethod
+    def get_cached_or_new(url: str, min_timestamp: Optional[datetime] = None) -> CompactLeaderboard:
+        """
+        Same as SrcRequest.get_cached_request_or_new, but only the compact leaderboard is kept in memory.
+        Cached leaderboards obtained before "min_timestamp" (in UTC) are fetched again.
+        """
+        url = canonicalize_url(url)
+
+        cached_leaderboard = compact_leaderboards.get(url)
+        if cached_leaderboard and (min_timestamp is None or cached_leaderboard.timestamp >= min_timestamp):
+            return cached_leaderboard
+
+        return leaderboards_in_flight.do(url, lambda: CompactLeaderboard._load_persisted_or_new(url, min_timestamp))
+
+    @staticmethod
+    def _load_persisted_or_new(url: str, min_timestamp: Optional[datetime]) -> CompactLeaderboard:
+        yesterday = datetime.utcnow() - timedelta(days=configs.last_updated_days[0])
+        if min_timestamp is not None:
+            yesterday = max(yesterday, min_timestamp)
+
+        cached_leaderboard = compact_leaderboards.get(url)
+        if cached_leaderboard and cached_leaderboard.timestamp >= yesterday:
+            return cached_leaderboard
+
+        # The database still holds the full response, it is shared with the other request types
+        expired_leaderboard = compact_leaderboards.get_stale(url)
+        try:
+            persisted_request, result = SrcRequest._load_persisted_or_revalidate(url, yesterday)
+        except UnderALotOfPressure:
+            if expired_leaderboard is None:
+                raise
+            print(f"WARNING: speedrun.com is unavailable, using the expired leaderboard {url}")
+            cached_leaderboard = copy(expired_leaderboard)
+            cached_leaderboard.is_stale = True
+            return cached_leaderboard
+
+        # No need to parse the leaderboard again if it's still the same as the expired one
+        if result is None \
+                and expired_leaderboard \
+                and expired_leaderboard.body_hash is not None \
+                and expired_leaderboard.body_hash == persisted_request.body_hash:
+            cached_leaderboard = copy(expired_leaderboard)
+            cached_leaderboard.timestamp = persisted_request.timestamp
+            # Players may have been banned since
+            cached_leaderboard._find_banned_players(banned_players.get_ids())
+        else:
+            cached_leaderboard = CompactLeaderboard(
+                (json.loads(persisted_request.serialized_result) if result is None else result)["data"],
+                persisted_request.timestamp,
+                banned_players.get_ids(),
+                persisted_request.body_hash)
+        # Keeps its old timestamp when stale, so it's fetched again once speedrun.com is back
+        cached_leaderboard.is_stale = persisted_request.is_stale
+        compact_leaderboards.set(
+            url,
+            cached_leaderboard,
+            cached_leaderboard.get_approximate_size(),
+            cached_leaderboard.timestamp)
+        return cached_leaderboard
+
+
+class GameMetadata:
+    """
+    What's needed of a game to validate and score its runs, so runs don't have to embed their game.
+    Games rarely change, so this is kept a lot longer than other requests.
+    """
+    game_id: str
+    name: str
+    gametypes: FrozenSet[str]
+    # Level id to level name
+    level_names: Dict[str, str]
+    subcategory_variable_ids: FrozenSet[str]
+    timestamp: datetime
+
+    def __init__(self, game: dict, timestamp: datetime) -> None:
+        """Parses the "data" of a speedrun.com game response that embeds its levels and variables"""
+        self.game_id = game["id"]
+        self.name = game["names"]["international"]
+        self.gametypes = frozenset(game["gametypes"])
+        self.level_names = {level["id"]: level["name"] for level in game["levels"]["data"]}
+        self.subcategory_variable_ids = frozenset(
+            variable["id"] for variable in game["variables"]["data"]
+            if variable["is-subcategory"])
+        self.timestamp = timestamp
+
+    def get_approximate_size(self) -> int:
+        return sys.getsizeof(self.level_names) + 128 * len(self.level_names) + 512
+
+    @staticmethod
+    def get_cached_or_new(game_id: str) -> GameMetadata:
+        cached_game = game_metadata.get(game_id)
+        if cached_game:
+            return cached_game
+
+        return game_metadata_in_flight.do(game_id, lambda: GameMetadata._load_persisted_or_new(game_id))
+
+    @staticmethod
+    def get_many(game_ids: Iterable[str]) -> Dict[str, GameMetadata]:
+        """Same as get_cached_or_new, but the games that aren't cached yet are fetched concurrently"""
+        games: Dict[str, GameMetadata] = {}
+
+        def get_game(game_id: str) -> None:
+            games[game_id] = GameMetadata.get_cached_or_new(game_id)
+
+        run_in_thread_pool(get_game, set(game_ids), configs.max_concurrent_requests)
+        return games
+
+    @staticmethod
+    def _load_persisted_or_new(game_id: str) -> GameMetadata:
+        cached_game = game_metadata.get(game_id)
+        if cached_game:
+            return cached_game
+
+        expiry = datetime.utcnow() - timedelta(days=configs.game_metadata_cache_days)
+        try:
+            persisted_request, result = SrcRequest._load_persisted_or_revalidate(
+                f"https://www.speedrun.com/api/v1/games/{game_id}?embed=levels,variables",
+                expiry)
+        except UnderALotOfPressure:
+            # Games rarely change, an expired one is as good as any
+            expired_game = game_metadata.get_stale(game_id)
+            if expired_game is None:
+                raise
+            return expired_game
+        cached_game = GameMetadata(
+            (json.loads(persisted_request.serialized_result) if result is None else result)["data"],
+            persisted_request.timestamp)
+        game_metadata.set(game_id, cached_game, cached_game.get_approximate_size(), cached_game.timestamp)
+        return cached_game
+
+
+class ScoredLeaderboard:
+    """
+    The terms of the scoring formula for a leaderboard, computed once per leaderboard.
+    Also holds the points of every valid run on that leaderboard, by run id.
+    See services.user_updater.score_leaderboard
+    """
+    level_fraction: float = 1
+    # When the leaderboard it was computed from was obtained, its CompactLeaderboard.body_hash, banned_player_ids
+    # and is_stale
+    timestamp: datetime
+    body_hash: Optional[str]
+    banned_player_ids: FrozenSet[str] = frozenset()
+    is_stale: bool = False
+    # False if no run can get points from this leaderboard, in which case the terms below are meaningless
+    is_scoreable: bool = False
+    category_name: str = ""
+    wr_time: float = 0.0
+    mean: float = 0.0
+    worst_time: float = 0.0
+    pre_cutoff_worst_time: float = 0.0
+    population: int = 0
+    points_by_run_id: Dict[str, float] = {}
+
+    def __init__(self, level_fraction: float, timestamp: datetime, body_hash: Optional[str] = None) -> None:
+        self.level_fraction = level_fraction
+        self.timestamp = timestamp
+        self.body_hash = body_hash
+        self.points_by_run_id = {}
+
+    def get_approximate_size(self) -> int:
+        # Rough size of a dict entry with an 8 characters key and a float value, plus the fixed attributes
+        return 128 * len(self.points_by_run_id) + 512
+
 
 class Run:
     id_: str = ""
@@ -79,7 +965,10 @@ class Run:
     level: str = ""
     level_name: str = ""
     level_fraction: float = 1
+    platform: Optional[str] = None
     _points: float = 0
+    # Scored from a stale leaderboard, see ScoredLeaderboard.is_stale
+    _is_provisional: bool = False
     # This below section is for game search
     _mean_time: float = 0
     _is_wr_time: bool = False
@@ -126,6 +1015,10 @@ class Run:
     def __hash__(self):
         return hash((self.category, self.level))
 
+    def get_personal_best_key(self) -> Tuple[str, str, str, Tuple[Tuple[str, str], ...]]:
+        """Unlike equality, also tells subcategories apart. Same as PersonalBestsTracker's identifier."""
+        return self.game, self.category, self.level, tuple(sorted(self.variables.items()))
+
     def to_dto(self) -> dict[str, Union[str, float]]:
         return {
             'gameName': self.game_name,
@@ -146,10 +1039,17 @@ class User:
     _country_code: Optional[str] = None
     _banned: bool = False
     _points_distribution: List[List[Run]] = [[], []]
+    # Every scored personal best, including the ones that aren't counted
+    _personal_bests: List[Run] = []
+    # Whether only the runs verified since the last update were fetched
+    _is_incremental_update: bool = False
+    # Whether some of the data couldn't be obtained from speedrun.com, see services.circuit_breaker
+    _is_provisional: bool = False
 
     def __init__(self, id_or_name: str) -> None:
         self._id = id_or_name
         self._name = id_or_name
+        self._personal_bests = []
 
     def __str__(self) -> str:
         return f"User: <{self._name}, {ceil(self._points * 100) / 100}, {self._id}{'(Banned)' if self._banned else ''}>"
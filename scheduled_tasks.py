@@ -0,0 +1,54 @@
+"""
+Tasks meant to be run periodically outside of the webworkers (ie: as PythonAnywhere scheduled tasks).
+Usage: `py ./scheduled_tasks.py <task-name>`
+"""
+from flask_app import app  # noqa: F401 Importing the app is what sets up the database connection
+from datetime import timedelta
+from models.core_models import Player
+from models.global_scoreboard_models import SrcRequest, UpdateJob
+from services.bulk_updater import refresh_banned_players, refresh_stale_players
+from typing import Callable, Dict
+import configs
+import sys
+
+FINISHED_UPDATE_JOBS_RETENTION = timedelta(days=1)
+
+
+def purge_cached_requests() -> None:
+    deleted_count = SrcRequest.purge_expired()
+    print(f"Purged {deleted_count} expired cached requests")
+
+
+def purge_update_jobs() -> None:
+    deleted_count = UpdateJob.purge_finished(FINISHED_UPDATE_JOBS_RETENTION)
+    print(f"Purged {deleted_count} finished update jobs")
+
+
+def recompute_ranks() -> None:
+    Player.recompute_ranks()
+    print("Recomputed every player's rank")
+
+
+def refresh_banned() -> None:
+    summary = refresh_banned_players()
+    print(f"Refreshed banned players: {summary}")
+
+
+def refresh_players() -> None:
+    summary = refresh_stale_players(configs.bulk_refresh_max_players)
+    print(f"Refreshed stale players: {summary}")
+
+
+TASKS: Dict[str, Callable[[], None]] = {
+    "purge-cached-requests": purge_cached_requests,
+    "purge-update-jobs": purge_update_jobs,
+    "recompute-ranks": recompute_ranks,
+    "refresh-banned-players": refresh_banned,
+    "refresh-players": refresh_players,
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in TASKS:
+        print(f"Usage: {sys.argv[0]} <{'|'.join(TASKS)}>")
+        sys.exit(1)
+    TASKS[sys.argv[1]]()
@@ -0,0 +1,181 @@
+"""
+Refreshes many players at once.
+Popular leaderboards are shared by a lot of players, so instead of updating players one at a time,
+every distinct leaderboard is fetched only once per refresh and all players are scored from that shared set.
+"""
+from math import ceil
+from models.core_models import Player
+from models.game_search_models import GameValues
+from models.global_scoreboard_models import BannedPlayer, banned_players, Run, ScoredLeaderboard, User
+from services.user_updater import build_run, count_run, get_leaderboard_url, get_personal_bests, \
+    get_scored_leaderboard, set_run_points, set_user_code_and_name, sum_up_user_points
+from services.user_updater_helpers import update_runner_in_database
+from services.utils import get_file, run_in_thread_pool, SpeedrunComError, UserUpdaterError
+from typing import Dict, List, NamedTuple, Optional
+import configs
+import traceback
+
+
+class PlannedRun(NamedTuple):
+    run: Run
+    leaderboard_url: str
+
+
+class PlayerRefreshPlan:
+    player: Player
+    user: User
+    planned_runs: List[PlannedRun]
+    not_found: bool = False
+    error: Optional[Dict[str, str]] = None
+
+    def __init__(self, player: Player) -> None:
+        self.player = player
+        self.user = User(player.user_id)
+        self.planned_runs = []
+
+
+def refresh_stale_players(max_players: int) -> Dict[str, int]:
+    """
+    Refreshes up to "max_players" players that haven't been updated in the past configs.last_updated_days[0] days,
+    see __get_stale_players.
+    Returns a summary of the refresh.
+    """
+    plans = [PlayerRefreshPlan(player) for player in __get_stale_players(max_players)]
+
+    # Get every player's personal bests ...
+    run_in_thread_pool(__plan_player_refresh, plans, configs.max_concurrent_requests)
+
+    # ... fetch and score every distinct leaderboard exactly once ...
+    level_fraction_by_leaderboard_url = {
+        planned_run.leaderboard_url: planned_run.run.level_fraction
+        for plan in plans if not plan.error
+        for planned_run in plan.planned_runs
+    }
+    leaderboard_urls = level_fraction_by_leaderboard_url.keys()
+    scored_leaderboards: Dict[str, Optional[ScoredLeaderboard]] = {}
+    failed_leaderboards: Dict[str, Dict[str, str]] = {}
+
+    def fetch_leaderboard(url: str) -> None:
+        try:
+            scored_leaderboards[url] = get_scored_leaderboard(url, level_fraction_by_leaderboard_url[url])
+        except UserUpdaterError as exception:
+            failed_leaderboards[url] = exception.args[0]
+
+    run_in_thread_pool(fetch_leaderboard, leaderboard_urls, configs.max_concurrent_requests)
+
+    # ... and score every player from that shared set
+    game_values: List[GameValues] = []
+    updated_count = 0
+    for plan in plans:
+        if plan.not_found:
+            print(f"User ID \"{plan.user._id}\" not found on speedrun.com. Removed it from the database.")
+            plan.player.delete()
+            continue
+        failed_leaderboard_error = next((
+            failed_leaderboards[planned_run.leaderboard_url]
+            for planned_run in plan.planned_runs
+            if planned_run.leaderboard_url in failed_leaderboards), None)
+        error = plan.error or failed_leaderboard_error
+        if error:
+            print(f"Not updating {plan.user} as some errors were caught: {error['error']}\n{error['details']}")
+            continue
+        try:
+            counted_runs: List[Run] = []
+            for planned_run in plan.planned_runs:
+                set_run_points(planned_run.run, scored_leaderboards[planned_run.leaderboard_url])
+                count_run(counted_runs, game_values, planned_run.run)
+                plan.user._personal_bests.append(planned_run.run)
+            sum_up_user_points(plan.user, counted_runs)
+            text_output, _ = update_runner_in_database(plan.player, plan.user)
+            print(text_output)
+            updated_count += 1
+        except Exception:
+            print(f"\nError: Unknown while updating {plan.user}\n{traceback.format_exc()}")
+
+    GameValues.create_or_update_many(game_values)
+
+    return {
+        "players": len(plans),
+        "updated": updated_count,
+        "runs": sum(len(plan.planned_runs) for plan in plans),
+        "leaderboards": len(leaderboard_urls),
+        "failedLeaderboards": len(failed_leaderboards),
+    }
+
+
+def refresh_banned_players() -> Dict[str, int]:
+    """
+    Checks whether every player known to be banned still is, since leaderboards don't say so anymore.
+    New banned players are found whenever a player is updated, see set_user_code_and_name.
+    Returns a summary of the refresh.
+    """
+    banned_player_ids = BannedPlayer.get_all_ids()
+    unbanned_player_ids: List[str] = []
+
+    def check_player(user_id: str) -> None:
+        try:
+            # Not cached, the point is to notice when this changes
+            is_banned = get_file(f"https://www.speedrun.com/api/v1/users/{user_id}")["data"]["role"] == "banned"
+        except SpeedrunComError:
+            # The user doesn't exist anymore, neither do their runs
+            is_banned = False
+        except UserUpdaterError as exception:
+            print(f"Couldn't check whether {user_id} is still banned: {exception.args[0]['error']}")
+            return
+        if not is_banned:
+            unbanned_player_ids.append(user_id)
+
+    run_in_thread_pool(check_player, banned_player_ids, configs.max_concurrent_requests)
+    for user_id in unbanned_player_ids:
+        banned_players.set_banned(user_id, False)
+
+    return {
+        "bannedPlayers": len(banned_player_ids),
+        "unbanned": len(unbanned_player_ids),
+    }
+
+
+def __get_stale_players(max_players: int) -> List[Player]:
+    """
+    Splits the players between the configs.last_updated_days tiers (ie: 7 to 30 days, 30 to 91 days and 91+ days).
+    Every tier gets an equal share of "max_players" first, so that a backlog of long inactive players
+    doesn't keep the players that just became stale from ever being refreshed.
+    The spots a tier doesn't fill go to the oldest tiers first.
+    The ones that have been waiting the longest come first within a tier.
+    """
+    tiers_days = sorted(configs.last_updated_days, reverse=True)
+    # Each tier ends where the previous (older) one starts
+    players_by_tier = [
+        Player.get_stale(days, max_players, tiers_days[index - 1] if index else None)
+        for index, days in enumerate(tiers_days)]
+
+    quota = ceil(max_players / len(tiers_days))
+    picked_counts: List[int] = []
+    for tier_players in players_by_tier:
+        picked_counts.append(min(len(tier_players), quota, max_players - sum(picked_counts)))
+    for index, tier_players in enumerate(players_by_tier):
+        picked_counts[index] += min(len(tier_players) - picked_counts[index], max_players - sum(picked_counts))
+
+    players: List[Player] = []
+    for days, tier_players, picked_count in zip(tiers_days, players_by_tier, picked_counts):
+        print(f"Refreshing {picked_count} players that haven't been updated in {days} days")
+        players += tier_players[:picked_count]
+    return players
+
+
+def __plan_player_refresh(plan: PlayerRefreshPlan) -> None:
+    try:
+        try:
+            set_user_code_and_name(plan.user)
+        except SpeedrunComError:
+            plan.not_found = True
+            return
+        if plan.user._banned:
+            return
+        for pb in get_personal_bests(plan.user):
+            run = build_run(pb)
+            plan.planned_runs.append(PlannedRun(run, get_leaderboard_url(run)))
+    except UserUpdaterError as exception:
+        plan.error = exception.args[0]
+    except Exception:
+        plan.error = {"error": "Unhandled exception in thread", "details": traceback.format_exc()}
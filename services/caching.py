@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from services.update_context import UpdateCancelledError
+from threading import Lock
+from typing import Callable, Dict, Generic, Hashable, NamedTuple, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class _CacheEntry(NamedTuple):
+    value: object
+    size: int
+    timestamp: datetime
+
+
+class BoundedTTLCache(Generic[V]):
+    """
+    Thread-safe Least Recently Used cache bounded by an approximate memory budget.
+    Entries also expire once they are older than "ttl".
+    Expired entries are kept until evicted or replaced, so they can still be revalidated (see get_stale).
+
+    Sizes are provided by the caller (ie: the length of the serialized response),
+    so the budget is only as accurate as that approximation.
+    """
+
+    def __init__(self, max_bytes: int, ttl: timedelta) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._current_bytes = 0
+        self._entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.timestamp < datetime.utcnow() - self.ttl:
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value  # type: ignore
+
+    def get_stale(self, key: Hashable) -> Optional[V]:
+        """Same as get, but also returns expired entries. Doesn't count as a hit or a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry.value  # type: ignore
+
+    def set(self, key: Hashable, value: V, size: int, timestamp: datetime) -> None:
+        with self._lock:
+            if key in self._entries:
+                self.__remove(key)
+            # Don't flush the whole cache for something that wouldn't fit anyway
+            if size > self.max_bytes:
+                return
+            self._entries[key] = _CacheEntry(value, size, timestamp)
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes:
+                self.__remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        """Same as get, but also removes the entry, so that only one caller ever gets it"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__remove(key)
+            if entry.timestamp < datetime.utcnow() - self.ttl:
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry.value  # type: ignore
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self.__remove(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._current_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __remove(self, key: Hashable) -> None:
+        self._current_bytes -= self._entries.pop(key).size
+
+
+class SingleFlight(Generic[V]):
+    """
+    Makes sure there is only ever one call in flight per key.
+    Concurrent callers with the same key wait for, and share, the result (or exception) of the first one.
+    Except when the first caller's update was cancelled, since the others weren't: they try again instead.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = Lock()
+
+    def do(self, key: Hashable, function: Callable[[], V]) -> V:
+        with self._lock:
+            call = self._calls.get(key)
+            is_first_caller = call is None
+            if call is None:
+                call = Future()
+                self._calls[key] = call
+        if not is_first_caller:
+            try:
+                return call.result()
+            except UpdateCancelledError:
+                return self.do(key, function)
+
+        try:
+            result = function()
+        except BaseException as exception:
+            call.set_exception(exception)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Callable, Optional
+
+# How often the state shared with other workers is read again
+SHARED_STATE_REFRESH_INTERVAL = timedelta(seconds=10)
+
+
+class CircuitBreaker:
+    """
+    Stops all requests to speedrun.com for "cooldown" once it failed "failure_threshold" times in a row.
+    Meant to be shared by every thread of the process.
+
+    Other workers are told when the circuit opens through "share_state_with" (see CircuitBreakerState),
+    so that they stop hammering speedrun.com too. Those callbacks are expected to handle their own errors.
+    """
+
+    def __init__(self, failure_threshold: int, cooldown: timedelta) -> None:
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._consecutive_failures = 0
+        self._open_until = datetime.min
+        self._load_shared_open_until: Optional[Callable[[], Optional[datetime]]] = None
+        self._save_shared_open_until: Optional[Callable[[datetime], None]] = None
+        self._shared_state_loaded_at = datetime.min
+        self._lock = Lock()
+
+    def share_state_with(
+            self,
+            load_open_until: Callable[[], Optional[datetime]],
+            save_open_until: Callable[[datetime], None]) -> None:
+        self._load_shared_open_until = load_open_until
+        self._save_shared_open_until = save_open_until
+
+    def get_open_until(self) -> Optional[datetime]:
+        """In UTC, None if requests can be sent"""
+        now = datetime.utcnow()
+        with self._lock:
+            if self._load_shared_open_until and now - self._shared_state_loaded_at >= SHARED_STATE_REFRESH_INTERVAL:
+                self._shared_state_loaded_at = now
+                self._open_until = max(self._open_until, self._load_shared_open_until() or datetime.min)
+            return self._open_until if self._open_until > now else None
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+
+    def on_server_error(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._consecutive_failures < self.failure_threshold:
+                return
+            self._consecutive_failures = 0
+            self._open_until = datetime.utcnow() + self.cooldown
+            open_until = self._open_until
+        print(f"WARNING: speedrun.com keeps failing. Not sending any request until {open_until} (UTC).")
+        if self._save_shared_open_until:
+            self._save_shared_open_until(open_until)
@@ -0,0 +1,101 @@
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from threading import local, Lock
+from time import perf_counter
+from typing import Any, Callable, Dict, Optional
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that calls "on_new_connection" every time its pools have to open a new connection"""
+
+    def __init__(self, on_new_connection: Callable[[], None], **kwargs: Any) -> None:
+        # HTTPAdapter.__init__ calls init_poolmanager
+        self._on_new_connection = on_new_connection
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        on_new_connection = self._on_new_connection
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                on_new_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                on_new_connection()
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+class HttpTransport:
+    """
+    Thread-safe HTTP client meant to be shared by every thread of the process.
+
+    requests.Session isn't thread-safe, so every thread gets its own.
+    They all share the same adapter though, which holds one pool of keep-alive connections per host.
+    Threads wait for a connection to be free rather than going over "max_connections_per_host".
+    """
+
+    def __init__(self, max_connections_per_host: int) -> None:
+        self.connections_opened = 0
+        self.requests_sent = 0
+        self.bytes_received = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._lock = Lock()
+        self._sessions = local()
+        self._adapter = _CountingHTTPAdapter(
+            self.__on_new_connection,
+            pool_maxsize=max_connections_per_host,
+            pool_block=True)
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        start = perf_counter()
+        response = self.__get_session().get(url, headers=headers)
+        latency = perf_counter() - start
+        # Bytes read from the socket, before decompression. The content has already been consumed (not streamed).
+        bytes_received = response.raw.tell() if response.raw else len(response.content)
+
+        with self._lock:
+            self.requests_sent += 1
+            self.bytes_received += bytes_received
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        return response
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "requests": self.requests_sent,
+                "connectionsOpened": self.connections_opened,
+                "connectionsReused": max(self.requests_sent - self.connections_opened, 0),
+                "bytesReceived": self.bytes_received,
+                "averageLatency": self.total_latency / self.requests_sent if self.requests_sent else 0,
+                "maxLatency": self.max_latency,
+            }
+
+    def __get_session(self) -> Session:
+        session: Optional[Session] = getattr(self._sessions, "session", None)
+        if session is None:
+            session = Session()
+            session.headers.update(DEFAULT_HEADERS)
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            self._sessions.session = session
+        return session
+
+    def __on_new_connection(self) -> None:
+        with self._lock:
+            self.connections_opened += 1
@@ -0,0 +1,82 @@
+"""
+Serialized and precompressed API payloads, rebuilt only when their PayloadVersion changes.
+Also answers conditional requests (If-None-Match) with a 304 without touching the data at all.
+"""
+from flask import current_app, json, request, Response
+from io import BytesIO
+from models.core_models import PayloadVersion
+from typing import Any, Callable, Dict, NamedTuple
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IDENTITY_ENCODING = "identity"
+# Ordered by preference
+SUPPORTED_ENCODINGS = (["br"] if brotli else []) + ["gzip", IDENTITY_ENCODING]
+
+
+class CachedPayload(NamedTuple):
+    version: int
+    # The same payload for each supported Content-Encoding
+    encoded_payloads: Dict[str, bytes]
+
+
+__cached_payloads: Dict[str, CachedPayload] = {}
+
+
+def get_cached_payload_response(name: str, build_payload: Callable[[], Any]) -> Response:
+    """
+    "name" is one of the PayloadVersion names.
+    "build_payload" returns the data to serialize as JSON. It's only called when the cached payload is outdated.
+    """
+    # Read the version before the data, so the data is never older than the version it's cached under
+    version = PayloadVersion.get_version(name)
+    if version is None:
+        return current_app.response_class(json.dumps(build_payload()), mimetype="application/json")
+
+    # Respects the quality values sent by the client (ie: "gzip;q=0"), then our own preference
+    encoding = request.accept_encodings.best_match(SUPPORTED_ENCODINGS, default=IDENTITY_ENCODING)
+    # A strong ETag promises the exact same bytes, so each encoding of the payload needs its own
+    etag = f"{name}-{version}-{encoding}"
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        cached_payload = __cached_payloads.get(name)
+        if cached_payload is None or cached_payload.version != version:
+            cached_payload = CachedPayload(version, __encode_payload(json.dumps(build_payload()).encode()))
+            __cached_payloads[name] = cached_payload
+
+        response = current_app.response_class(
+            cached_payload.encoded_payloads[encoding],
+            mimetype="application/json")
+        if encoding != IDENTITY_ENCODING:
+            response.headers["Content-Encoding"] = encoding
+
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    # Browsers can keep the payload, but have to check it's still the latest version every time
+    response.cache_control.no_cache = True
+    return response
+
+
+def __encode_payload(payload: bytes) -> Dict[str, bytes]:
+    encoded_payloads: Dict[str, bytes] = {}
+    if brotli:
+        encoded_payloads["br"] = brotli.compress(payload)
+    encoded_payloads["gzip"] = __gzip_compress(payload)
+    encoded_payloads[IDENTITY_ENCODING] = payload
+    return encoded_payloads
+
+
+def __gzip_compress(payload: bytes) -> bytes:
+    """
+    Unlike gzip.compress, doesn't write the current time in the header.
+    So every worker sends the same bytes under the same ETag.
+    """
+    buffer = BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as gzip_file:
+        gzip_file.write(payload)
+    return buffer.getvalue()
@@ -0,0 +1,88 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from threading import Event, Lock
+from time import monotonic, sleep
+from typing import Optional
+
+# Multiplicative decrease factor applied to the rate when speedrun.com says we're going too fast
+RATE_DECREASE_FACTOR = 0.5
+# Additive increase of the rate after each successful request (in requests per minute)
+RATE_INCREASE_PER_MINUTE = 1
+DEFAULT_RATE_LIMITED_DELAY = 5
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket meant to be shared by every thread of the process.
+
+    The refill rate adapts AIMD style: it's cut when speedrun.com answers with 420 (Enhance Your Calm)
+    then slowly grows back up to the allowed rate with every successful request.
+    This keeps the throughput close to the API's limit instead of bursting and stalling.
+    """
+
+    def __init__(self, max_requests_per_minute: float, burst: int = 10) -> None:
+        self.max_rate = max_requests_per_minute / 60
+        self.min_rate = 1 / 60
+        self.rate = self.max_rate
+        self.capacity = burst
+        self._tokens = float(burst)
+        self._last_refill = monotonic()
+        self._paused_until = 0.0
+        self._lock = Lock()
+
+    def acquire(self, cancellation: Optional[Event] = None) -> bool:
+        """
+        Blocks until a request can be sent.
+        Returns False, without using up a request, as soon as "cancellation" is set.
+        """
+        while True:
+            if cancellation is not None and cancellation.is_set():
+                return False
+            with self._lock:
+                now = monotonic()
+                self.__refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_time = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            if cancellation is None:
+                sleep(wait_time)
+            else:
+                cancellation.wait(wait_time)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE_PER_MINUTE / 60)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> float:
+        """
+        Slows down every thread going through this limiter.
+        Returns the amount of seconds before requests are allowed again.
+        """
+        with self._lock:
+            now = monotonic()
+            # Many threads usually get rate limited at the same time, only slow down once per pause
+            if now >= self._paused_until:
+                self.rate = max(self.min_rate, self.rate * RATE_DECREASE_FACTOR)
+                self._tokens = 0
+            delay = retry_after if retry_after is not None else DEFAULT_RATE_LIMITED_DELAY
+            self._paused_until = max(self._paused_until, now + delay)
+            return self._paused_until - now
+
+    def __refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+def parse_retry_after(retry_after: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header, which is either an amount of seconds or an HTTP date"""
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,116 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from threading import Event, local, Lock
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+from weakref import WeakSet
+
+T = TypeVar("T")
+
+ProgressCallback = Callable[[int, int], None]
+
+# The UpdateContext each thread is currently working for, see UpdateContext.activated
+_current = local()
+
+
+class UpdateCancelledError(Exception):
+    """Raised in the threads of an update that has been cancelled, instead of sending more requests"""
+    pass
+
+
+class UpdateContext:
+    """
+    The state of a single user update, shared by all of its threads (and only by them).
+
+    Errors are collected rather than raised, so that they can all be reported once the threads are done.
+    The first one cancels the update: its threads stop before their next request to speedrun.com
+    (see services.utils.get_file), as nothing would be saved anyway.
+    """
+
+    def __init__(self, on_progress: Optional[ProgressCallback] = None) -> None:
+        """Calls "on_progress" with the amount of runs scored so far and the total amount of runs to score"""
+        self.errors: List[Dict[str, Any]] = []
+        self.runs_to_score_count = 0
+        self.scored_runs_count = 0
+        self.cancellation = Event()
+        self._on_progress = on_progress
+        self._children: WeakSet[UpdateContext] = WeakSet()
+        self._lock = Lock()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.cancellation.is_set()
+
+    def fail(self, error: Dict[str, Any]) -> None:
+        """Records "error", formatted like the argument of a UserUpdaterError, and cancels the update"""
+        with self._lock:
+            self.errors.append(error)
+        self.cancel()
+
+    def cancel(self) -> None:
+        """Stops the threads of the update without recording an error, ie: when the error is raised instead"""
+        self.cancellation.set()
+        with self._lock:
+            children = list(self._children)
+        for child in children:
+            child.cancel()
+
+    def create_child(self) -> UpdateContext:
+        """
+        A context for part of the update, whose threads can be stopped on their own once their work isn't needed.
+        Cancelled along with this one. Its errors and progress aren't reported to this one.
+        """
+        child = UpdateContext()
+        with self._lock:
+            self._children.add(child)
+        if self.is_cancelled:
+            child.cancel()
+        return child
+
+    def raise_if_cancelled(self) -> None:
+        if self.is_cancelled:
+            raise UpdateCancelledError()
+
+    def add_runs_to_score(self, count: int = 1) -> None:
+        with self._lock:
+            self.runs_to_score_count += count
+
+    def on_run_scored(self) -> None:
+        with self._lock:
+            self.scored_runs_count += 1
+        self.report_progress()
+
+    def report_progress(self) -> None:
+        if not self._on_progress:
+            return
+        with self._lock:
+            progress = (self.scored_runs_count, self.runs_to_score_count)
+        self._on_progress(*progress)
+
+    @contextmanager
+    def activated(self) -> Iterator[UpdateContext]:
+        """Makes this the current context of the calling thread until the end of the with statement"""
+        previous_context = get_current_update_context()
+        _current.context = self
+        try:
+            yield self
+        finally:
+            _current.context = previous_context
+
+
+def get_current_update_context() -> Optional[UpdateContext]:
+    return getattr(_current, "context", None)
+
+
+def bind_to_current_update_context(function: Callable[..., T]) -> Callable[..., T]:
+    """
+    Threads don't inherit the context of the thread that started them.
+    Wraps "function" so that it runs in the current context of the calling thread, if any, from any thread.
+    """
+    context = get_current_update_context()
+    if context is None:
+        return function
+
+    def run_in_context(*args: Any, **kwargs: Any) -> T:
+        with context.activated():
+            return function(*args, **kwargs)
+    return run_in_context
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+from models.core_models import db
+from models.global_scoreboard_models import UpdateJob
+from services.user_updater import get_updated_user
+from services.utils import UnderALotOfPressure, UnhandledThreadException, UserUpdaterError
+from time import monotonic
+from typing import Callable, Optional
+import configs
+import json
+import traceback
+
+# Minimum amount of seconds between two progress updates of the same job
+PROGRESS_UPDATE_INTERVAL = 1
+# Database connections left to the web requests and to the threads of the running updates.
+# The pool has no overflow, so requests would otherwise time out waiting for a connection.
+RESERVED_DATABASE_CONNECTIONS = 2
+
+update_jobs_executor = ThreadPoolExecutor(max_workers=max(
+    1,
+    min(configs.max_concurrent_update_jobs, configs.sql_pool_size - RESERVED_DATABASE_CONNECTIONS)))
+
+
+def enqueue_update_job(name_or_id: str, on_done: Optional[Callable[[], None]] = None) -> UpdateJob:
+    """
+    Queues a user update to be run by the background workers.
+    "on_done" is called from the worker thread once the update is over, whether it succeeded or not.
+    """
+    update_job = UpdateJob.create(name_or_id)
+    update_jobs_executor.submit(__run_update_job, update_job.job_id, name_or_id, on_done)
+    return update_job
+
+
+def __run_update_job(job_id: str, name_or_id: str, on_done: Optional[Callable[[], None]]) -> None:
+    last_progress_update = 0.0
+
+    def on_progress(progress_done: int, progress_total: int) -> None:
+        nonlocal last_progress_update
+        now = monotonic()
+        if now - last_progress_update >= PROGRESS_UPDATE_INTERVAL or progress_done == progress_total:
+            last_progress_update = now
+            UpdateJob.update_progress(job_id, progress_done, progress_total)
+
+    try:
+        # Given up on while it was queued, see UpdateJob.is_abandoned
+        update_job = UpdateJob.get(job_id)
+        if not update_job or update_job.is_finished():
+            return
+        UpdateJob.update_by_id(job_id, status=UpdateJob.STATUS_RUNNING)
+        try:
+            result = get_updated_user(name_or_id, on_progress)
+            status = UpdateJob.STATUS_DONE
+            status_code = 400 if result["state"] == "warning" else 200
+            body = json.dumps(result)
+        except UnderALotOfPressure:
+            # Meme code for meme error
+            status, status_code, body = UpdateJob.STATUS_FAILED, 418, ""
+        except UserUpdaterError as exception:
+            status, status_code = UpdateJob.STATUS_FAILED, 424
+            body = f"Error: {exception.args[0]['error']}\n{exception.args[0]['details']}"
+        except UnhandledThreadException as exception:
+            status, status_code = UpdateJob.STATUS_FAILED, 500
+            body = f"{type(exception).__name__}: {exception.args[0]}"
+        except Exception:
+            status, status_code = UpdateJob.STATUS_FAILED, 500
+            body = f"Error: Unknown\n{traceback.format_exc()}"
+        UpdateJob.update_by_id(job_id, status=status, status_code=status_code, result=body)
+    except Exception:
+        print(f"\nError: Couldn't save the state of update job {job_id}\n{traceback.format_exc()}")
+    finally:
+        if on_done:
+            on_done()
+        # Worker threads are reused, don't keep this job's session around
+        db.session.remove()
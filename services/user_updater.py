@@ -1,17 +1,23 @@
 from collections import Counter
-from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import copy
+from datetime import datetime, timedelta, timezone
 from math import exp, floor, pi
 from models.game_search_models import GameValues
 from models.core_models import db, Player
-from models.global_scoreboard_models import PointsDistributionDto, Run, SrcRequest, User
+from models.global_scoreboard_models import banned_players, compact_leaderboards, CompactLeaderboard, game_metadata, \
+    GameMetadata, memoized_requests, PlayerRunScore, PointsDistributionDto, Run, ScoredLeaderboard, \
+    scored_leaderboards, SrcRequest, User
 from time import strftime
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Tuple, Union
 from threading import Thread
-from services.user_updater_helpers import BasicJSONType, extract_valid_personal_bests, get_probability_terms, \
-    get_subcategory_variables, keep_runs_before_soft_cutoff, MIN_LEADERBOARD_SIZE, update_runner_in_database, \
-    extract_top_runs_and_score, extract_sorted_valid_runs_from_leaderboard
-from services.utils import start_and_wait_for_threads, \
-    SpeedrunComError, UnhandledThreadException, UserUpdaterError
+from services.user_updater_helpers import BasicJSONType, compute_leaderboard_statistics, \
+    extract_valid_personal_bests, get_subcategory_variables, get_verify_date, MIN_LEADERBOARD_SIZE, \
+    PersonalBestsTracker, update_runner_in_database, extract_top_runs_and_score
+from services.update_context import bind_to_current_update_context, ProgressCallback, UpdateCancelledError, \
+    UpdateContext
+from services.utils import canonicalize_url, run_in_thread_pool, start_and_wait_for_threads, transport, \
+    SpeedrunComError, UnderALotOfPressure, UnhandledThreadException, UserUpdaterError
 from urllib.parse import unquote
 import configs
 import httplib2
@@ -20,22 +26,32 @@ import requests
 import traceback
 
 TIME_BONUS_DIVISOR = 3600 * 12  # 12h (1/2 day) for +100%
-
-
-def get_updated_user(p_user_id: str) -> Dict[str, Union[str, None, float, int, PointsDistributionDto]]:
-    """Called from flask_app and AutoUpdateUsers.run()"""
-    global threads_exceptions
-    # threads_exceptions: List[Exception] = []
-    threads_exceptions = []
+# Most incremental updates only find a handful of new runs
+INCREMENTAL_UPDATE_PAGE_SIZE = 50
+# Runs verified while the previous update was running may not have been seen by it
+INCREMENTAL_UPDATE_OVERLAP = timedelta(hours=1)
+
+
+def get_updated_user(
+        p_user_id: str,
+        p_on_progress: Optional[ProgressCallback] = None) \
+        -> Dict[str, Union[str, None, float, int, PointsDistributionDto]]:
+    """
+    Called from services.update_jobs. See services.bulk_updater to update many players at once.
+    "p_on_progress" is called with the amount of runs scored so far and the total amount of runs to score
+    """
+    context = UpdateContext(p_on_progress)
     text_output: str = p_user_id
     result_state: str = "info"
+    rank: Optional[int] = None
+    rank_change: Optional[int] = None
 
     try:
         user = User(p_user_id)
         print(f"Update request for: {user._name}")
 
         try:
-            __set_user_code_and_name(user)
+            set_user_code_and_name(user)
         except SpeedrunComError:
             # ID doesn't exists on speedrun.com but it does in the database, remove it
             player = Player.get(user._name)
@@ -43,8 +59,7 @@ def get_updated_user(p_user_id: str) -> Dict[str, Union[str, None, float, int, P
                 text_output = (f"User ID \"{user._id}\" not found on speedrun.com. "
                                "\nRemoved it from the database.")
                 result_state = "warning"
-                db.session.delete(player)
-                db.session.commit()
+                player.delete()
             else:
                 text_output = (f"User \"{user._id}\" not found. "
                                "\nMake sure the name or ID is typed properly. "
@@ -61,23 +76,46 @@ def get_updated_user(p_user_id: str) -> Dict[str, Union[str, None, float, int, P
                 (datetime.now() - player.last_update).days >= configs.last_updated_days[0] or \
                     configs.bypass_update_restrictions:
 
-                __set_user_points(user)
-
-                if not threads_exceptions:
+                incremental_update_start = __get_incremental_update_start(player)
+                __release_database_connection()
+                try:
+                    with context.activated():
+                        if not incremental_update_start or \
+                                not __set_user_points_incremental(user, incremental_update_start, context):
+                            __set_user_points(user, context)
+                # Stopped early because of the errors reported below
+                except UpdateCancelledError:
+                    pass
+                print(f"Requests cache: {memoized_requests.stats()}")
+                print(f"Compact leaderboards cache: {compact_leaderboards.stats()}")
+                print(f"Scored leaderboards cache: {scored_leaderboards.stats()}")
+                print(f"Game metadata cache: {game_metadata.stats()}")
+                print(f"HTTP transport: {transport.stats()}")
+
+                if not context.errors:
                     print(f"\nLooking for {user._id}")
+                    previous_rank = player.rank if player else None
                     text_output, result_state = update_runner_in_database(player, user)
+                    if user._is_provisional:
+                        text_output += "\nspeedrun.com is currently unavailable, so some of the runs were scored " \
+                            "from older leaderboards. This score is provisional, try updating again later."
+                    updated_player = Player.get(user._id)
+                    rank = updated_player.rank if updated_player else None
+                    # Positive when climbing the scoreboard
+                    if rank is not None and previous_rank is not None:
+                        rank_change = previous_rank - rank
                 else:
                     errors_str = "Please report to: https://github.com/Avasam/Global_Speedrunning_Scoreboard/issues\n" \
                         "\nNot uploading data as some errors were caught during execution:\n"
-                    if len(threads_exceptions) == 1:
-                        raise UnhandledThreadException(threads_exceptions[0]["error"] +
+                    if len(context.errors) == 1:
+                        raise UnhandledThreadException(context.errors[0]["error"] +
                                                        "\n" +
                                                        errors_str +
-                                                       str(threads_exceptions[0]["details"]))
+                                                       str(context.errors[0]["details"]))
                     else:
                         error_str_items = Counter(
                             [f"Error: {e['error']}\n{e['details']}"
-                             for e in threads_exceptions]) \
+                             for e in context.errors]) \
                             .items()
                         for error, count in error_str_items:
                             errors_str += f"[x{count}] {error}\n"
@@ -94,10 +132,12 @@ def get_updated_user(p_user_id: str) -> Dict[str, Union[str, None, float, int, P
             'countryCode': user._country_code,
             'score': floor(user._points),
             'lastUpdate': strftime("%Y-%m-%d %H:%M"),
-            'rank': None,
+            'rank': rank,
+            'rankChange': rank_change,
             'scoreDetails': user.get_points_distribution_dto(),
             'message': text_output,
             'state': result_state,
+            'isProvisional': user._is_provisional,
         }
 
     except httplib2.ServerNotFoundError as exception:
@@ -107,7 +147,7 @@ def get_updated_user(p_user_id: str) -> Dict[str, Union[str, None, float, int, P
         raise UserUpdaterError({"error": "Connexion interrupted", "details": exception})
 
 
-def __set_user_code_and_name(user: User) -> None:
+def set_user_code_and_name(user: User) -> None:
     url = "https://www.speedrun.com/api/v1/users/{user}".format(user=user._id)
     infos = SrcRequest.get_cached_response_or_new(url)
 
@@ -121,166 +161,409 @@ def __set_user_code_and_name(user: User) -> None:
     if infos["data"]["role"] == "banned":
         user._banned = True
         user._points = 0
+    # Leaderboards don't embed their players, so this is how banned players are found
+    banned_players.set_banned(user._id, user._banned)
+
 
+def get_personal_bests(user: User) -> List[BasicJSONType]:
+    runs: List[BasicJSONType] = SrcRequest.get_paginated_response(__get_personal_bests_url(user))["data"]
+    GameMetadata.get_many(run["game"] for run in runs)
+    return extract_valid_personal_bests(runs)
+
+
+def __get_personal_bests_url(user: User) -> str:
+    # The games' levels and variables are the same for every run, see GameMetadata
+    return "https://www.speedrun.com/api/v1/runs?user={user}&status=verified&max={pagesize}" \
+        .format(user=user._id, pagesize=200)
 
-def __set_user_points(user: User) -> None:
-    global threads_exceptions
+
+def __set_user_points(user: User, context: UpdateContext) -> None:
+    """Meant to be called with "context" activated, see UpdateContext.activated"""
     counted_runs: List[Run] = []
+    game_values: List[GameValues] = []
+    personal_bests = PersonalBestsTracker()
+    scored_runs: Dict[str, Run] = {}
 
     def set_points_thread(pb: BasicJSONType) -> None:
         try:
-            if threads_exceptions:
+            if context.is_cancelled:
                 # Don't keep going if previous threads already threw something
                 print("Aborted thread due to previous thread exceptions")
                 return
-            pb_subcategory_variables = get_subcategory_variables(pb)
-
-            pb_level_id = pb["level"]["data"]["id"] if pb["level"]["data"] else ""
-            pb_level_name = pb["level"]["data"]["name"] if pb["level"]["data"] else ""
-            run: Run = Run(pb["id"],
-                           pb["times"]["primary_t"],
-                           pb["game"]["data"]["id"],
-                           pb["game"]["data"]["names"]["international"],
-                           pb["category"],
-                           pb_subcategory_variables,
-                           pb_level_id,
-                           pb_level_name,
-                           len(pb["game"]["data"]["levels"]["data"]))
+            # A better run for the same category was found on a later page
+            if not personal_bests.is_personal_best(pb):
+                return
+            run = build_run(pb)
             __set_run_points(run)
+            scored_runs[pb["id"]] = run
 
-            # If a category has already been counted, only keep the one that's worth the most.
-            # This can happen in leaderboards with coop runs or subcategories.
-            if run._points > 0:
-                for i, counted_run in enumerate(counted_runs):
-                    if counted_run == run:
-                        if run._points > counted_run._points:
-                            counted_runs[i] = run
-                        break
-                else:
-                    counted_runs.append(run)
-
-            # Used to allow searching for games by their worth
-            # Run should be worth more than 1 point, not be a level and be made by WR holder
-            if run._points >= 1 and not run.level and run._is_wr_time:
-                # TODO : Current issues with subcategories where they try to create at the same time bc in two threads
-                # Solution 1: Include subcategories as part of PRIMARY key
-                # Solution 2: Batch create/update AFTER all threads are done running
-                GameValues.create_or_update(
-                    run_id=run.id_,
-                    game_id=run.game,
-                    category_id=run.category,
-                    platform_id=pb["system"]["platform"],
-                    wr_time=floor(run.primary_t),
-                    wr_points=floor(run._points),
-                    mean_time=floor(run._mean_time),
-                )
-
+        # Another thread failed while this one was waiting to send a request
+        except UpdateCancelledError:
+            pass
         except UserUpdaterError as exception:
-            threads_exceptions.append(exception.args[0])
+            context.fail(exception.args[0])
         except Exception:
-            threads_exceptions.append({"error": "Unhandled exception in thread", "details": traceback.format_exc()})
+            context.fail({"error": "Unhandled exception in thread", "details": traceback.format_exc()})
+        finally:
+            context.on_run_scored()
 
     if user._banned:
         user._points = 0
         return
 
-    url = "https://www.speedrun.com/api/v1/runs?user={user}&status=verified" \
-        "&embed=level,game.levels,game.variables&max={pagesize}" \
-        .format(user=user._id, pagesize=200)
-    runs: List[BasicJSONType] = SrcRequest.get_paginated_response(url)["data"]
-    runs = extract_valid_personal_bests(runs)
+    if configs.use_legacy_update_threads:
+        for page in SrcRequest.iterate_paginated_response(__get_personal_bests_url(user)):
+            GameMetadata.get_many(run["game"] for run in page)
+            for run in page:
+                personal_bests.add(run)
+        runs = personal_bests.get_personal_bests()
+        context.add_runs_to_score(len(runs))
+        context.report_progress()
+        threads = [Thread(target=bind_to_current_update_context(set_points_thread), args=(run,))
+                   for run in runs]
+        start_and_wait_for_threads(threads)
+    else:
+        # Start scoring the personal bests as soon as they're found, while the next pages are still being fetched.
+        # The leaderboard of a run later replaced by a better one is still needed, so its fetch isn't wasted.
+        scoring_futures: List[Future] = []
+        with ThreadPoolExecutor(configs.max_concurrent_requests) as executor:
+            try:
+                for page in SrcRequest.iterate_paginated_response(__get_personal_bests_url(user)):
+                    GameMetadata.get_many(run["game"] for run in page)
+                    for run in page:
+                        if personal_bests.add(run):
+                            context.add_runs_to_score()
+                            scoring_futures.append(
+                                executor.submit(bind_to_current_update_context(set_points_thread), run))
+                    context.report_progress()
+            # The queued threads would still fetch their leaderboard while the executor shuts down
+            except BaseException:
+                context.cancel()
+                raise
+        # Re-raises any exception that escaped set_points_thread, like run_in_thread_pool does
+        for scoring_future in scoring_futures:
+            scoring_future.result()
+
+    # Only count the runs that are still personal bests once every page has been seen, in a stable order
+    for pb in personal_bests.get_personal_bests():
+        run = scored_runs.get(pb["id"])
+        if run:
+            count_run(counted_runs, game_values, run)
+            user._personal_bests.append(run)
+
+    GameValues.create_or_update_many(game_values)
+    sum_up_user_points(user, counted_runs)
+
+
+def __set_user_points_incremental(
+        user: User,
+        verified_since: datetime,
+        context: UpdateContext) -> bool:
+    """
+    Only fetches the runs verified since "verified_since" (in UTC) and merges them with the personal bests stored
+    by the previous update. Only the leaderboards of new personal bests are fetched again no matter what,
+    the others are re-scored from the caches until they expire.
+    Returns False without doing anything if nothing was stored, in which case a full update is needed.
+    Meant to be called with "context" activated, see UpdateContext.activated
+    """
+    personal_bests: Dict[Tuple[str, str, str, Tuple[Tuple[str, str], ...]], Run] = {
+        run.get_personal_best_key(): run for run in PlayerRunScore.get_personal_bests(user._id)}
+    __release_database_connection()
+    if user._banned or not personal_bests:
+        return False
+
+    # The leaderboards cached before a new personal best was verified don't have it yet
+    min_leaderboard_timestamps: Dict[str, datetime] = {}
+    new_personal_bests = PersonalBestsTracker()
+    try:
+        new_runs = __get_runs_verified_since(user, verified_since)
+    # Still re-score the stored personal bests, new runs will be found by the next update
+    except UnderALotOfPressure as exception:
+        print(f"WARNING: Couldn't get the runs verified since the last update: {exception.args[0]['details']}")
+        new_runs = []
+        user._is_provisional = True
+    GameMetadata.get_many(run["game"] for run in new_runs)
+    for pb in new_runs:
+        new_personal_bests.add(pb)
+    for pb in new_personal_bests.get_personal_bests():
+        run = build_run(pb)
+        key = run.get_personal_best_key()
+        stored_run = personal_bests.get(key)
+        if not stored_run or stored_run.id_ == run.id_ or stored_run.primary_t > run.primary_t:
+            personal_bests[key] = run
+            min_leaderboard_timestamps[run.id_] = get_verify_date(pb)
+
+    runs = list(personal_bests.values())
+    context.add_runs_to_score(len(runs))
+    context.report_progress()
+
+    def set_points_thread(run: Run) -> None:
+        try:
+            if context.is_cancelled:
+                return
+            set_run_points(run, get_scored_leaderboard(
+                get_leaderboard_url(run),
+                run.level_fraction,
+                min_leaderboard_timestamps.get(run.id_)))
+        except UpdateCancelledError:
+            pass
+        except UserUpdaterError as exception:
+            context.fail(exception.args[0])
+        except Exception:
+            context.fail({"error": "Unhandled exception in thread", "details": traceback.format_exc()})
+        finally:
+            context.on_run_scored()
 
-    threads = [Thread(target=set_points_thread, args=(run,))
-               for run in runs]
-    start_and_wait_for_threads(threads)
+    run_in_thread_pool(set_points_thread, runs, configs.max_concurrent_requests)
 
+    counted_runs: List[Run] = []
+    game_values: List[GameValues] = []
+    for run in runs:
+        count_run(counted_runs, game_values, run)
+    user._personal_bests = runs
+    user._is_incremental_update = True
+
+    GameValues.create_or_update_many(game_values)
+    sum_up_user_points(user, counted_runs)
+    return True
+
+
+def __get_runs_verified_since(user: User, verified_since: datetime) -> List[BasicJSONType]:
+    """Stops requesting pages as soon as a run verified before "verified_since" (in UTC) is found"""
+    runs: List[BasicJSONType] = []
+    for page in SrcRequest.iterate_paginated_response(__get_recently_verified_runs_url(user)):
+        for run in page:
+            verify_date = get_verify_date(run)
+            if verify_date is None or verify_date < verified_since:
+                return runs
+            runs.append(run)
+    return runs
+
+
+def __get_recently_verified_runs_url(user: User) -> str:
+    return "https://www.speedrun.com/api/v1/runs?user={user}&status=verified" \
+        "&orderby=verify-date&direction=desc&max={pagesize}" \
+        .format(user=user._id, pagesize=INCREMENTAL_UPDATE_PAGE_SIZE)
+
+
+def __release_database_connection() -> None:
+    """
+    Ends the current thread's read-only transaction, which otherwise holds a pooled connection until its next commit.
+    Meant to be called before scoring, as the scoring threads need those connections. Expires the loaded models.
+    """
+    db.session.commit()
+
+
+def __get_incremental_update_start(player: Optional[Player]) -> Optional[datetime]:
+    """
+    The verify date (in UTC) from which runs have to be fetched again,
+    or None if the player needs a full update.
+    """
+    if not player or not player.last_update or not player.last_full_update:
+        return None
+    # Runs that have since been rejected or deleted are only noticed by a full update
+    if (datetime.now() - player.last_full_update).days >= configs.full_update_interval_days:
+        return None
+    # last_update is in the server's local time
+    last_update = player.last_update.astimezone(timezone.utc).replace(tzinfo=None)
+    return last_update - INCREMENTAL_UPDATE_OVERLAP
+
+
+def build_run(pb: BasicJSONType) -> Run:
+    game = GameMetadata.get_cached_or_new(pb["game"])
+    pb_subcategory_variables = get_subcategory_variables(pb)
+
+    pb_level_id = pb["level"] or ""
+    pb_level_name = game.level_names.get(pb_level_id, "")
+    run = Run(pb["id"],
+              pb["times"]["primary_t"],
+              game.game_id,
+              game.name,
+              pb["category"],
+              pb_subcategory_variables,
+              pb_level_id,
+              pb_level_name,
+              len(game.level_names))
+    run.platform = pb["system"]["platform"]
+    return run
+
+
+def count_run(counted_runs: List[Run], game_values: List[GameValues], run: Run) -> None:
+    """Keeps track of a run once it has been scored"""
+    # If a category has already been counted, only keep the one that's worth the most.
+    # This can happen in leaderboards with coop runs or subcategories.
+    if run._points > 0:
+        for i, counted_run in enumerate(counted_runs):
+            if counted_run == run:
+                if run._points > counted_run._points:
+                    counted_runs[i] = run
+                break
+        else:
+            counted_runs.append(run)
+
+    # Used to allow searching for games by their worth
+    # Run should be worth more than 1 point, not be a level and be made by WR holder
+    # Saved all at once after all runs are done, so subcategories don't race for the same row
+    if run._points >= 1 and not run.level and run._is_wr_time:
+        game_values.append(GameValues(
+            run_id=run.id_,
+            game_id=run.game,
+            category_id=run.category,
+            platform_id=run.platform,
+            wr_time=floor(run.primary_t),
+            wr_points=floor(run._points),
+            mean_time=floor(run._mean_time),
+        ))
+
+
+def sum_up_user_points(user: User, counted_runs: List[Run]) -> None:
     # Sum up the runs' score, only the top 60 will end up giving points
     top_runs, lower_runs = extract_top_runs_and_score(counted_runs)
     user._points = sum(run._points for run in top_runs)
     user._points_distribution = [top_runs, lower_runs]
+    user._is_provisional = user._is_provisional or any(run._is_provisional for run in user._personal_bests)
 
 
-def __set_run_points(run: Run) -> None:
-    run._points = 0
+def get_leaderboard_url(run: Run) -> str:
     # If the run is an Individual Level, adapt the request url
     lvl_cat_str = "level/{level}/".format(level=run.level) if run.level else "category/"
     url = "https://www.speedrun.com/api/v1/leaderboards/{game}/" \
-        "{lvl_cat_str}{category}?video-only=true&embed=players".format(
+        "{lvl_cat_str}{category}?video-only=true".format(
             game=run.game,
             lvl_cat_str=lvl_cat_str,
             category=run.category)
-    for var_id, var_value in run.variables.items():
+    # Sorted so that the same subcategories always give the same url (and cache key)
+    for var_id, var_value in sorted(run.variables.items()):
         url += "&var-{id}={value}".format(id=var_id, value=var_value)
+    return url
+
+
+def get_scored_leaderboard(
+        url: str,
+        level_fraction: float,
+        min_timestamp: Optional[datetime] = None) -> Optional[ScoredLeaderboard]:
+    """
+    Fetches and scores the leaderboard, unless it has already been scored recently (and after "min_timestamp").
+    Returns None if the leaderboard doesn't exist.
+    """
+    url = canonicalize_url(url)
+    scored_leaderboard = scored_leaderboards.get((url, level_fraction))
+    if scored_leaderboard and (min_timestamp is None or scored_leaderboard.timestamp >= min_timestamp):
+        return scored_leaderboard
+
     try:
-        leaderboard = SrcRequest.get_cached_response_or_new(url)
+        leaderboard = CompactLeaderboard.get_cached_or_new(url, min_timestamp)
     # If SRC returns 404 here, most likely the run references a category or level that does not exist anymore
     except SpeedrunComError as exception:
         if exception.args[0]['error'] == "404 (speedrun.com)":
-            return
+            return None
         else:
             raise
 
-    valid_runs = extract_sorted_valid_runs_from_leaderboard(leaderboard["data"], run.level_fraction)
-    len_valid_runs = len(valid_runs)
-
-    # CHECK: Avoid useless computation and errors
-    if len_valid_runs < MIN_LEADERBOARD_SIZE:
-        return
-
-    # Remove last 5%
-    valid_runs = valid_runs[:int(len_valid_runs * 0.95) or None]
+    # No need to score the leaderboard again if it's still the same as the expired one
+    expired_scored_leaderboard = scored_leaderboards.get_stale((url, level_fraction))
+    if expired_scored_leaderboard \
+            and expired_scored_leaderboard.body_hash is not None \
+            and expired_scored_leaderboard.body_hash == leaderboard.body_hash \
+            and expired_scored_leaderboard.banned_player_ids == leaderboard.banned_player_ids:
+        scored_leaderboard = copy(expired_scored_leaderboard)
+        scored_leaderboard.timestamp = leaderboard.timestamp
+        scored_leaderboard.is_stale = leaderboard.is_stale
+    else:
+        scored_leaderboard = score_leaderboard(leaderboard, level_fraction)
+    # Expires along with the leaderboard it was computed from
+    scored_leaderboards.set(
+        (url, level_fraction),
+        scored_leaderboard,
+        scored_leaderboard.get_approximate_size(),
+        leaderboard.timestamp)
+    return scored_leaderboard
+
+
+def score_leaderboard(leaderboard: CompactLeaderboard, level_fraction: float) -> ScoredLeaderboard:
+    """Computes the terms of the formula and the points of every valid run of the leaderboard in a single pass"""
+    scored_leaderboard = ScoredLeaderboard(level_fraction, leaderboard.timestamp, leaderboard.body_hash)
+    scored_leaderboard.banned_player_ids = leaderboard.banned_player_ids
+    scored_leaderboard.is_stale = leaderboard.is_stale
+    statistics = compute_leaderboard_statistics(leaderboard, level_fraction)
 
-    # Find the time that's most often repeated in the leaderboard
-    # (after the 80th percentile) and cut off everything after that
-    pre_cutoff_worst_time = valid_runs[-1]["run"]["times"]["primary_t"]
-    valid_runs = keep_runs_before_soft_cutoff(valid_runs)
+    # CHECK: All runs must not have the exact same time
+    if statistics is None or statistics.standard_deviation <= 0:
+        return scored_leaderboard
+
+    scored_leaderboard.is_scoreable = True
+    scored_leaderboard.wr_time = statistics.wr_time
+    scored_leaderboard.mean = statistics.mean
+    scored_leaderboard.worst_time = statistics.worst_time
+    scored_leaderboard.pre_cutoff_worst_time = statistics.pre_cutoff_worst_time
+    scored_leaderboard.population = statistics.population
+    # Set category name
+    scored_leaderboard.category_name = re.sub(
+        r"((\d\d)$|Any)(?!%)",
+        r"\1%",
+        unquote(leaderboard.weblink.split('#')[1])
+        .rstrip('1')
+        .replace("_", " ")
+        .title()
+    )
+    scored_leaderboard.points_by_run_id = {
+        run_id: get_points(scored_leaderboard, primary_t)
+        for run_id, primary_t in zip(statistics.run_ids, statistics.valid_times)
+    }
 
-    wr_time = valid_runs[0]["run"]["times"]["primary_t"]
-    mean, standard_deviation, population = get_probability_terms(valid_runs)
+    return scored_leaderboard
 
-    # CHECK: All runs must not have the exact same time
-    if standard_deviation <= 0:
-        return
 
+def get_points(scored_leaderboard: ScoredLeaderboard, primary_t: float) -> float:
     # Get the +- deviation from the mean
-    signed_deviation = mean - run.primary_t
+    signed_deviation = scored_leaderboard.mean - primary_t
     # Get the deviation from the mean of the worse time as a positive number
-    worst_time = valid_runs[-1]["run"]["times"]["primary_t"]
-    lowest_deviation = worst_time - mean
+    lowest_deviation = scored_leaderboard.worst_time - scored_leaderboard.mean
     # Shift the deviations up so that the worse time is now 0
     adjusted_deviation = signed_deviation + lowest_deviation
 
     # CHECK: The last counted run isn't worth any points, if this is 0 the rest of the formula will return 0
     if adjusted_deviation <= 0:
-        return
+        return 0
 
     # Scale all the adjusted deviations so that the mean is worth 1 but the worse stays 0...
     # using the lowest time's deviation from before the "repeated times" fix!
     # (runs not affected by the prior fix won't see any difference)
-    adjusted_lowest_deviation = pre_cutoff_worst_time - mean
+    adjusted_lowest_deviation = scored_leaderboard.pre_cutoff_worst_time - scored_leaderboard.mean
     normalized_deviation = adjusted_deviation / adjusted_lowest_deviation
 
     # More people means more accurate relative time and more optimised/hard to reach low times
     # This function would equal 0 if population = MIN_LEADERBOARD_SIZE - 1
-    certainty_adjustment = 1 - 1 / (population - MIN_LEADERBOARD_SIZE + 2)
+    certainty_adjustment = 1 - 1 / (scored_leaderboard.population - MIN_LEADERBOARD_SIZE + 2)
     # Cap the deviation to π
     e_exponent = min(normalized_deviation, pi) * certainty_adjustment
     # Bonus points for long games
-    length_bonus = 1 + (wr_time / TIME_BONUS_DIVISOR)
+    length_bonus = 1 + (scored_leaderboard.wr_time / TIME_BONUS_DIVISOR)
 
     # Give points, hard cap to 6 character
-    run._points = (exp(e_exponent) - 1) * 10 * length_bonus * run.level_fraction
+    return (exp(e_exponent) - 1) * 10 * length_bonus * scored_leaderboard.level_fraction
 
-    # Set category name
-    run.category_name = re.sub(
-        r"((\d\d)$|Any)(?!%)",
-        r"\1%",
-        unquote(leaderboard["data"]["weblink"].split('#')[1])
-        .rstrip('1')
-        .replace("_", " ")
-        .title()
-    )
+
+def __set_run_points(run: Run) -> None:
+    set_run_points(run, get_scored_leaderboard(get_leaderboard_url(run), run.level_fraction))
+
+
+def set_run_points(run: Run, scored_leaderboard: Optional[ScoredLeaderboard]) -> None:
+    run._points = 0
+    run._is_provisional = scored_leaderboard is not None and scored_leaderboard.is_stale
+    if scored_leaderboard is None or not scored_leaderboard.is_scoreable:
+        return
+
+    # Every valid run of the leaderboard has already been scored, only fallback to the formula for the others
+    points = scored_leaderboard.points_by_run_id.get(run.id_)
+    if points is None:
+        points = get_points(scored_leaderboard, run.primary_t)
+    if points <= 0:
+        return
+
+    run._points = points
+    run.category_name = scored_leaderboard.category_name
 
     # Set game search data
-    run._is_wr_time = wr_time == run.primary_t
-    run._mean_time = mean
+    run._is_wr_time = scored_leaderboard.wr_time == run.primary_t
+    run._mean_time = scored_leaderboard.mean
@@ -1,52 +1,98 @@
+from datetime import datetime
 from math import floor
-from models.core_models import Player
-from models.global_scoreboard_models import Run, User
+from models.core_models import db, Player
+from models.global_scoreboard_models import CompactLeaderboard, GameMetadata, PlayerRunScore, Run, User
 from time import strftime
-from typing import Any, Dict, List, Tuple
-import json
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 GAMETYPE_MULTI_GAME = "rj1dy1o8"
+VERIFY_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 BasicJSONType = Dict[str, Any]
 MIN_LEADERBOARD_SIZE = 3  # This is just to optimize as the formula gives 0 points to leaderboards size < 3
 MIN_SAMPLE_SIZE = 60
 
 
-def extract_valid_personal_bests(runs: List[BasicJSONType]) -> List[BasicJSONType]:
+class LeaderboardStatistics(NamedTuple):
+    # Ids and times of the valid runs, sorted by time
+    run_ids: List[str]
+    valid_times: List[float]
+    wr_time: float
+    # Worst counted time after removing the last 5%, but before the soft cutoff
+    pre_cutoff_worst_time: float
+    worst_time: float
+    mean: float
+    standard_deviation: float
+    population: int
+
+
+class PersonalBestsTracker:
     """
-    Check if it's a valid run:
-    - is over a minute (or an IL, we don't have access to the IL's fraction yet)
-    - not a "multi-game" gametype
-    - has a category
-    - has video verification
+    Keeps the best valid run of each game, category, level and subcategories, as runs are added.
+    Runs can be added one page at a time: a better run found later replaces the previous one in place.
+    The GameMetadata of the runs' games should already be cached, see GameMetadata.get_many
     """
-    best_know_runs: BasicJSONType = {}
 
-    def keep_if_pb(run: BasicJSONType):
-        game = run["game"]["data"]["id"]
+    def __init__(self) -> None:
+        self._best_known_runs: Dict[str, BasicJSONType] = {}
+
+    @staticmethod
+    def _get_identifier(run: BasicJSONType) -> str:
+        game = run["game"]
         category = run["category"]
-        level = run["level"]["data"]["id"] if run["level"]["data"] else ""
+        level = run["level"] or ""
         sorted_dict = sorted(get_subcategory_variables(run).items())
         subcategories = str(sorted_dict)
-        identifier = game + category + level + subcategories
-
-        existing_best = best_know_runs.get(identifier)
+        return game + category + level + subcategories
+
+    def add(self, run: BasicJSONType) -> bool:
+        """
+        Check if it's a valid run:
+        - is over a minute (or an IL, we don't have access to the IL's fraction yet)
+        - not a "multi-game" gametype
+        - has a category
+        - has video verification
+
+        Returns True if the run is valid and the best one known so far for its category
+        """
+        if not ((not run["level"] or run["times"]["primary_t"] >= 60)
+                and GAMETYPE_MULTI_GAME not in GameMetadata.get_cached_or_new(run["game"]).gametypes
+                and run["category"]
+                and run.get("videos")):
+            return False
+
+        identifier = self._get_identifier(run)
+        existing_best = self._best_known_runs.get(identifier)
         if not existing_best \
                 or existing_best["times"]["primary_t"] > run["times"]["primary_t"]:
-            best_know_runs[identifier] = run
+            self._best_known_runs[identifier] = run
+            return True
+        return False
 
+    def is_personal_best(self, run: BasicJSONType) -> bool:
+        """Whether a run returned by "add" is still the best one known for its category"""
+        return self._best_known_runs.get(self._get_identifier(run)) is run
+
+    def get_personal_bests(self) -> List[BasicJSONType]:
+        return list(self._best_known_runs.values())
+
+
+def extract_valid_personal_bests(runs: List[BasicJSONType]) -> List[BasicJSONType]:
+    """See PersonalBestsTracker.add"""
+    personal_bests = PersonalBestsTracker()
     for run in runs:
-        if (not run["level"]["data"] or run["times"]["primary_t"] >= 60) \
-                and GAMETYPE_MULTI_GAME not in run["game"]["data"]["gametypes"] \
-                and run["category"] \
-                and run.get("videos"):
-            keep_if_pb(run)
+        personal_bests.add(run)
 
-    return list(best_know_runs.values())
+    return personal_bests.get_personal_bests()
 
 
 def extract_sorted_valid_runs_from_leaderboard(
-        leaderboard: BasicJSONType,
-        level_fraction: float) -> List[BasicJSONType]:
+        leaderboard: CompactLeaderboard,
+        level_fraction: float) -> List[int]:
     """
     Check if the run is valid:
     - none of the players are banned
@@ -58,26 +104,21 @@ def extract_sorted_valid_runs_from_leaderboard(
     - has more than MIN_LEADERBOARD_SIZE players
     - not a scoreboard
 
-    Returns the sorted valid runs from a leaderboard. Or empty list if the leaderboard is invalid.
+    Returns the positions of the valid runs in the leaderboard, sorted by time.
+    Or empty list if the leaderboard is invalid.
     """
     # Note: If needed in the future, level_fraction could be extracted from the leaderboard data
-    if len(leaderboard["runs"]) < MIN_LEADERBOARD_SIZE:
+    if len(leaderboard) < MIN_LEADERBOARD_SIZE:
         return []
-    wr = leaderboard["runs"][0]["run"]
-    wr_time = wr["times"]["primary_t"]
+    times = leaderboard.primary_times
+    wr_time = times[0]
     if wr_time < 60 * level_fraction:
         return []
 
     is_board_known_speedrun = False
 
-    # Get a list of all banned players in this leaderboard
-    banned_players = [p["id"] for p in leaderboard["players"]["data"]
-                      if p.get("role") == "banned"]
-
-    valid_runs = []
-    for run in leaderboard["runs"]:
-        value = run["run"]["times"]["primary_t"]
-
+    valid_positions = []
+    for position, value in enumerate(times):
         # Making sure this is a speedrun and not a score leaderboard
         # To avoid false negatives due to missing primary times, stop comparing once we know it's a speedrun
         if not is_board_known_speedrun:
@@ -87,12 +128,12 @@ def extract_sorted_valid_runs_from_leaderboard(
                 is_board_known_speedrun = True
 
         # Check if the run is valid
-        if run["place"] > 0 \
-                and run["run"].get("videos") \
-                and not any(p.get("id") in banned_players for p in run["run"]["players"]):
-            valid_runs.append(run)
+        if leaderboard.places[position] > 0 \
+                and leaderboard.has_videos[position] \
+                and not leaderboard.has_banned_player(position):
+            valid_positions.append(position)
 
-    return sorted(valid_runs, key=lambda r: r["run"]["times"]["primary_t"])
+    return sorted(valid_positions, key=times.__getitem__)
 
 
 def get_subcategory_variables(run: BasicJSONType) -> Dict[str, Dict[str, str]]:
@@ -101,12 +142,7 @@ def get_subcategory_variables(run: BasicJSONType) -> Dict[str, Dict[str, str]]:
     - key: variable id (ex: Framerate)
     - value: variable value (ex: 60 FPS, 144hz, Uncapped)
     """
-    # Get a list of the game's subcategory variables
-    game_subcategory_ids: List[str] = [
-        game_variable["id"]
-        for game_variable in run["game"]["data"]["variables"]["data"]
-        if game_variable["is-subcategory"]
-    ]
+    game_subcategory_ids = GameMetadata.get_cached_or_new(run["game"]).subcategory_variable_ids
 
     # Only Keep the variables that are one of the game's subcategories
     return {
@@ -116,12 +152,21 @@ def get_subcategory_variables(run: BasicJSONType) -> Dict[str, Dict[str, str]]:
     }
 
 
-def get_probability_terms(pbs: List[BasicJSONType]):
+def get_verify_date(run: BasicJSONType) -> Optional[datetime]:
+    """In UTC. Runs verified before speedrun.com started keeping track don't have one."""
+    verify_date = run["status"].get("verify-date")
+    return datetime.strptime(verify_date, VERIFY_DATE_FORMAT) if verify_date else None
+
+
+def get_probability_terms(times: Sequence[float]):
+    """
+    This stays a sequential loop even for the vectorized statistics:
+    vectorized sums are pairwise and wouldn't give the exact same floats.
+    """
     mean: float = 0.0
     sigma: float = 0.0
     population: int = 0
-    for pb in pbs:
-        value = pb["run"]["times"]["primary_t"]
+    for value in times:
         population += 1
         mean_temp = mean
         mean += (value - mean_temp) / population
@@ -131,16 +176,15 @@ def get_probability_terms(pbs: List[BasicJSONType]):
     return mean, standard_deviation, population
 
 
-def keep_runs_before_soft_cutoff(runs: List[BasicJSONType]):
-    i: int = len(runs)
-    cut_off_80th_percentile: int = runs[int(i*0.8)]["run"]["times"]["primary_t"]
+def keep_times_before_soft_cutoff(times: List[float]):
+    i: int = len(times)
+    cut_off_80th_percentile: float = times[int(i*0.8)]
     count: int = 0
     most_repeated_time_lowest_pos: int = 0
     most_repeated_time_count: int = 0
-    previous_value: int = 0
+    previous_value: float = 0
     # Go in reverse this way we can break at the percentile
-    for run in reversed(runs):
-        value: int = run["run"]["times"]["primary_t"]
+    for value in reversed(times):
         if value == previous_value:
             count += 1
         else:
@@ -156,11 +200,124 @@ def keep_runs_before_soft_cutoff(runs: List[BasicJSONType]):
             # Have the most repeated time repeat at least a certain amount
             if most_repeated_time_count > MIN_LEADERBOARD_SIZE:
                 # Actually keep the last one as it'll be worth 0 points and used for other calculations
-                return runs[:most_repeated_time_lowest_pos]
+                return times[:most_repeated_time_lowest_pos]
             break
         i -= 1
 
-    return runs
+    return times
+
+
+def keep_times_before_soft_cutoff_vectorized(times: "np.ndarray") -> "np.ndarray":
+    """Same as keep_times_before_soft_cutoff, with the same exact results"""
+    cut_off_80th_percentile = times[int(len(times) * 0.8)]
+    # Only the times from the 80th percentile onward are analyzed, and only if there's a faster time than it
+    first_analyzed_pos = int(np.searchsorted(times, cut_off_80th_percentile))
+    if first_analyzed_pos == 0:
+        return times
+
+    analyzed_times = times[first_analyzed_pos:]
+    group_starts = np.flatnonzero(np.concatenate(([True], analyzed_times[1:] != analyzed_times[:-1])))
+    repeat_counts = np.diff(np.append(group_starts, len(analyzed_times))) - 1
+    # On a tie, the slowest of the most repeated times wins
+    most_repeated_group = len(repeat_counts) - 1 - int(np.argmax(repeat_counts[::-1]))
+
+    # Have the most repeated time repeat at least a certain amount
+    if repeat_counts[most_repeated_group] > MIN_LEADERBOARD_SIZE:
+        # Actually keep the first one as it'll be worth 0 points and used for other calculations
+        return times[:first_analyzed_pos + int(group_starts[most_repeated_group]) + 1]
+    return times
+
+
+def get_leaderboard_statistics(
+        leaderboard: CompactLeaderboard,
+        level_fraction: float) -> Optional[LeaderboardStatistics]:
+    """
+    Computes the terms needed by the formula. Returns None if there isn't enough valid runs.
+    Pure python implementation, see get_leaderboard_statistics_vectorized
+    """
+    valid_positions = extract_sorted_valid_runs_from_leaderboard(leaderboard, level_fraction)
+    len_valid_runs = len(valid_positions)
+
+    # CHECK: Avoid useless computation and errors
+    if len_valid_runs < MIN_LEADERBOARD_SIZE:
+        return None
+
+    valid_times = [leaderboard.primary_times[position] for position in valid_positions]
+    # Remove last 5%
+    counted_times = valid_times[:int(len_valid_runs * 0.95) or None]
+
+    # Find the time that's most often repeated in the leaderboard
+    # (after the 80th percentile) and cut off everything after that
+    pre_cutoff_worst_time = counted_times[-1]
+    counted_times = keep_times_before_soft_cutoff(counted_times)
+
+    return LeaderboardStatistics(
+        [leaderboard.run_ids[position] for position in valid_positions],
+        valid_times,
+        counted_times[0],
+        pre_cutoff_worst_time,
+        counted_times[-1],
+        *get_probability_terms(counted_times))
+
+
+def get_leaderboard_statistics_vectorized(
+        leaderboard: CompactLeaderboard,
+        level_fraction: float) -> Optional[LeaderboardStatistics]:
+    """
+    Same as get_leaderboard_statistics, with the same exact results,
+    but the validity checks, sort, trim and cutoff are done on arrays over the leaderboard's columns.
+    """
+    len_runs = len(leaderboard)
+    if len_runs < MIN_LEADERBOARD_SIZE:
+        return None
+    times = np.frombuffer(leaderboard.primary_times, np.float64)
+    wr_time = times[0]
+    if wr_time < 60 * level_fraction:
+        return None
+
+    # Making sure this is a speedrun and not a score leaderboard
+    different_times = times[times != wr_time]
+    if len(different_times) and different_times[0] < wr_time:
+        return None
+
+    # Check if the runs are valid
+    is_valid = (np.frombuffer(leaderboard.places, np.intc) > 0) \
+        & np.frombuffer(leaderboard.has_videos, np.byte).astype(np.bool_)
+    if leaderboard.banned_player_ids:
+        is_banned_player = np.fromiter(
+            (player_id in leaderboard.banned_player_ids for player_id in leaderboard.player_ids),
+            np.bool_,
+            len(leaderboard.player_ids))
+        run_position_of_players = np.repeat(
+            np.arange(len_runs),
+            np.diff(np.frombuffer(leaderboard.player_offsets, np.intc)))
+        is_valid[run_position_of_players[is_banned_player]] = False
+
+    valid_positions = np.flatnonzero(is_valid)
+    # Stable sort, to keep the same order as sorted() for equal times
+    valid_positions = valid_positions[np.argsort(times[valid_positions], kind="stable")]
+    len_valid_runs = len(valid_positions)
+
+    # CHECK: Avoid useless computation and errors
+    if len_valid_runs < MIN_LEADERBOARD_SIZE:
+        return None
+
+    valid_times = times[valid_positions]
+    # Remove last 5%
+    counted_times = valid_times[:int(len_valid_runs * 0.95) or None]
+    pre_cutoff_worst_time = counted_times[-1]
+    counted_times = keep_times_before_soft_cutoff_vectorized(counted_times)
+
+    return LeaderboardStatistics(
+        [leaderboard.run_ids[position] for position in valid_positions.tolist()],
+        valid_times.tolist(),
+        float(counted_times[0]),
+        float(pre_cutoff_worst_time),
+        float(counted_times[-1]),
+        *get_probability_terms(counted_times.tolist()))
+
+
+compute_leaderboard_statistics = get_leaderboard_statistics if np is None else get_leaderboard_statistics_vectorized
 
 
 def extract_top_runs_and_score(runs: List[Run]) -> Tuple[List[Run], List[Run]]:
@@ -203,6 +360,15 @@ def extract_top_runs_and_score(runs: List[Run]) -> Tuple[List[Run], List[Run]]:
 
 def update_runner_in_database(player: Player, user: User):
     timestamp = strftime("%Y-%m-%d %H:%M")
+    # A provisional score doesn't count as an update, so the player can be updated again as soon as possible.
+    # New players still need a last update to be listed, but their next update has to be a full one.
+    last_update = timestamp
+    last_full_update = timestamp
+    if user._is_provisional:
+        last_update = player.last_update if player else timestamp
+        last_full_update = player.last_full_update if player else None
+    elif user._is_incremental_update:
+        last_full_update = player.last_full_update if player else timestamp
     text_output = ""
     result_state = ""
 
@@ -219,8 +385,13 @@ def update_runner_in_database(player: Player, user: User):
             player.update(name=user._name,
                           country_code=user._country_code,
                           score=floor(user._points),
-                          score_details=json.dumps(user.get_points_distribution_dto()),
-                          last_update=timestamp)
+                          # Superseded by PlayerRunScore
+                          score_details=None,
+                          last_update=last_update,
+                          last_full_update=last_full_update,
+                          # Committed along with the run scores, so the score never goes without its details
+                          commit=False)
+            __replace_run_scores(user)
         # User is banned: remove the database entry
         else:
             result_state = "warning"
@@ -234,11 +405,22 @@ def update_runner_in_database(player: Player, user: User):
                       name=user._name,
                       country_code=user._country_code,
                       score=user._points,
-                      score_details=json.dumps(user.get_points_distribution_dto()),
-                      last_update=timestamp)
+                      last_update=last_update,
+                      last_full_update=last_full_update,
+                      commit=False)
+        __replace_run_scores(user)
     else:
         text_output = f"Not inserting new data as {user} " \
             f"{'is banned' if user._banned else 'has a score lower than 1'}."
         result_state = "warning"
 
     return text_output, result_state
+
+
+def __replace_run_scores(user: User) -> None:
+    """Commits the player's pending changes along with their run scores, or neither of them"""
+    try:
+        PlayerRunScore.replace_for_player(user._id, user._points_distribution, user._personal_bests)
+    except Exception:
+        db.session.rollback()
+        raise
@@ -1,16 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
 from random import randint
-from requests import Session
+from datetime import timedelta
+from services.circuit_breaker import CircuitBreaker
+from services.http_transport import HttpTransport
+from services.rate_limiter import AdaptiveRateLimiter, parse_retry_after
+from services.update_context import bind_to_current_update_context, get_current_update_context, \
+    UpdateCancelledError
 from threading import Thread, active_count
 from time import sleep
-from typing import Any, cast, Dict, List, Optional, Union
+from typing import Any, Callable, cast, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple, TypeVar, Union
+from urllib import parse
+import configs
 import json
 import requests
 import simplejson
 
 HTTP_RETRYABLE_ERRORS = [401, 420, 502]
+HTTP_RATE_LIMITED = 420
+HTTP_NOT_MODIFIED = 304
+# Counted by the circuit breaker. 500 isn't one of them: speedrun.com answers it to pages that are too big.
+HTTP_SERVER_ERRORS = [502, 503, 504]
 HTTP_ERROR_RETRY_DELAY_MIN = 5
 HTTP_ERROR_RETRY_DELAY_MAX = 15
 
+T = TypeVar("T")
+
 
 class UserUpdaterError(Exception):
     """ Usage: raise UserUpdaterError({"error":"On Status Label", "details":"Details of error"}) """
@@ -27,11 +41,26 @@ class UnderALotOfPressure(SpeedrunComError):
     pass
 
 
+class CircuitOpenError(UnderALotOfPressure):
+    """Raised instead of sending a request while speedrun.com is considered down, see CircuitBreaker"""
+    pass
+
+
 class UnhandledThreadException(Exception):
     pass
 
 
-session: Session = Session()
+class ResponseValidators(NamedTuple):
+    """The headers speedrun.com gave to check whether a response has changed since, see get_file_if_modified"""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+transport = HttpTransport(configs.max_connections_per_host)
+rate_limiter = AdaptiveRateLimiter(configs.src_requests_per_minute)
+circuit_breaker = CircuitBreaker(
+    configs.circuit_breaker_failure_threshold,
+    timedelta(seconds=configs.circuit_breaker_cooldown_seconds))
 
 
 def get_file(p_url: str, p_headers: Dict[str, Any] = None) -> dict:
@@ -43,17 +72,68 @@ def get_file(p_url: str, p_headers: Dict[str, Any] = None) -> dict:
     :param p_url:  # The url to query
     :param p_headers:
     """
+    return cast(dict, __get_file(p_url, p_headers)[0])
+
+
+def get_file_if_modified(
+        p_url: str,
+        p_validators: Optional[ResponseValidators]) -> Tuple[Optional[dict], ResponseValidators]:
+    """
+    Same as get_file, but returns None instead of the content
+    if it hasn't changed since the response "p_validators" were obtained from.
+    Also returns the validators of the new response, or the same ones if it hasn't changed.
+    """
+    headers: Dict[str, str] = {}
+    if p_validators and p_validators.etag:
+        headers["If-None-Match"] = p_validators.etag
+    if p_validators and p_validators.last_modified:
+        headers["If-Modified-Since"] = p_validators.last_modified
+
+    json_data, response_headers = __get_file(p_url, headers)
+    validators = ResponseValidators(response_headers.get("ETag"), response_headers.get("Last-Modified"))
+    if json_data is None and p_validators:
+        # A 304 doesn't have to repeat the validators
+        validators = ResponseValidators(
+            validators.etag or p_validators.etag,
+            validators.last_modified or p_validators.last_modified)
+    return json_data, validators
+
+
+def __get_file(p_url: str, p_headers: Optional[Dict[str, Any]]) -> Tuple[Optional[dict], Mapping[str, str]]:
+    """Returns the content of "url" parsed as JSON dict (or None if not modified) and the headers of the response"""
     print(p_url)
+    context = get_current_update_context()
     while True:
+        # Don't spend requests on an update that already failed
+        if context:
+            context.raise_if_cancelled()
+        open_until = circuit_breaker.get_open_until()
+        if open_until:
+            raise CircuitOpenError({
+                "error": "speedrun.com is under a lot of pressure",
+                "details": f"Not sending any request until {open_until:%H:%M:%S} (UTC)",
+            })
+        if not rate_limiter.acquire(context.cancellation if context else None):
+            raise UpdateCancelledError()
         try:
-            raw_data = session.get(p_url, headers=p_headers)
+            raw_data = transport.get(p_url, headers=p_headers)
         except (ConnectionResetError, requests.exceptions.ConnectionError) as exception:  # Connexion error
+            circuit_breaker.on_server_error()
             raise UserUpdaterError({
                 "error": "Can't establish connexion to speedrun.com. "
                 f"Please try again ({exception.__class__.__name__})",
                 "details": exception,
             })
 
+        if raw_data.status_code in HTTP_SERVER_ERRORS:
+            circuit_breaker.on_server_error()
+        else:
+            circuit_breaker.on_success()
+
+        if raw_data.status_code == HTTP_NOT_MODIFIED:
+            rate_limiter.on_success()
+            return None, raw_data.headers
+
         try:
             json_data = raw_data.json()
         # Didn't receive a JSON file ...
@@ -62,9 +142,13 @@ def get_file(p_url: str, p_headers: Dict[str, Any] = None) -> dict:
             try:
                 raw_data.raise_for_status()
             except requests.exceptions.HTTPError as exception:  # ... because it's an HTTP error
-                if raw_data.status_code in HTTP_RETRYABLE_ERRORS:
+                if raw_data.status_code == HTTP_RATE_LIMITED:
+                    retry_delay = rate_limiter.on_rate_limited(parse_retry_after(raw_data.headers.get("Retry-After")))
+                    print(f"WARNING: {exception.args[0]}. Slowing down, retrying in {retry_delay:.1f} seconds.")
+                    # No break or raise as we want to retry
+                elif raw_data.status_code in HTTP_RETRYABLE_ERRORS:
                     print(f"WARNING: {exception.args[0]}. Retrying in {HTTP_ERROR_RETRY_DELAY_MIN} seconds.")
-                    sleep(HTTP_ERROR_RETRY_DELAY_MIN)
+                    __sleep_unless_cancelled(HTTP_ERROR_RETRY_DELAY_MIN)
                     # No break or raise as we want to retry
                 elif raw_data.status_code == 503:
                     raise UnderALotOfPressure({"error": f"HTTPError {raw_data.status_code}",
@@ -79,20 +163,47 @@ def get_file(p_url: str, p_headers: Dict[str, Any] = None) -> dict:
 
         else:
             if "status" in json_data:  # Speedrun.com custom error
-                if json_data["status"] in HTTP_RETRYABLE_ERRORS:
+                if json_data["status"] == HTTP_RATE_LIMITED:
+                    retry_delay = rate_limiter.on_rate_limited(parse_retry_after(raw_data.headers.get("Retry-After")))
+                    print("WARNING: {status}. {message}. Slowing down, retrying in {delay:.1f} seconds.".format(
+                        status=json_data["status"],
+                        message=json_data["message"],
+                        delay=retry_delay))
+                    # No break or raise as we want to retry
+                elif json_data["status"] in HTTP_RETRYABLE_ERRORS:
                     retry_delay = randint(HTTP_ERROR_RETRY_DELAY_MIN, HTTP_ERROR_RETRY_DELAY_MAX)
                     print("WARNING: {status}. {message}. Retrying in {delay} seconds.".format(
                         status=json_data["status"],
                         message=json_data["message"],
                         delay=retry_delay))
-                    sleep(retry_delay)
+                    __sleep_unless_cancelled(retry_delay)
                     # No break or raise as we want to retry
                 else:
                     raise SpeedrunComError(
                         {"error": f"{json_data['status']} (speedrun.com)", "details": json_data["message"]})
 
             else:  # No error
-                return json_data
+                rate_limiter.on_success()
+                return json_data, raw_data.headers
+
+
+def __sleep_unless_cancelled(seconds: float) -> None:
+    """Wakes up early if the current update is cancelled, see UpdateContext"""
+    context = get_current_update_context()
+    if context:
+        context.cancellation.wait(seconds)
+    else:
+        sleep(seconds)
+
+
+def canonicalize_url(p_url: str) -> str:
+    """
+    Sorts the query parameters of "p_url" so that equivalent requests share the same cache key.
+    Commas are left as is since speedrun.com uses them as lists separators (ie: embed=level,game).
+    """
+    url = parse.urlsplit(p_url)
+    query = parse.urlencode(sorted(parse.parse_qsl(url.query, keep_blank_values=True)), safe=",")
+    return parse.urlunsplit(url._replace(query=query))
 
 
 def parse_str_to_bool(string_to_parse: Optional[str]) -> bool:
@@ -119,5 +230,18 @@ def start_and_wait_for_threads(threads: List[Thread]):
         t.join()
 
 
+def run_in_thread_pool(target: Callable[[T], None], items: Iterable[T], max_workers: int) -> None:
+    """
+    Calls "target" for every item using a fixed amount of worker threads
+    and waits for all of them to be done.
+    Unlike start_and_wait_for_threads, this never holds more than "max_workers" threads (and sockets) at once.
+    The worker threads share the calling thread's UpdateContext.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Consuming the results re-raises any exception that escaped "target"
+        for _ in executor.map(bind_to_current_update_context(target), items):
+            pass
+
+
 def map_to_dto(dto_mappable_object_list) -> List[Dict[str, Union[str, bool, int]]]:
     return [dto_mappable_object.to_dto() for dto_mappable_object in dto_mappable_object_list]
@@ -0,0 +1,24 @@
+"""
+Runs the models against an in-memory SQLite database instead of MySQL.
+Like the app itself, requires a configs.py (see README.md).
+"""
+from flask import Flask
+from models.core_models import db, PayloadVersion
+import pytest
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.app = app
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(PayloadVersion(name=PayloadVersion.PLAYERS, version=1))
+        db.session.add(PayloadVersion(name=PayloadVersion.GAME_VALUES, version=1))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,36 @@
+from api.game_search_api import api
+from models.game_search_models import GameValues
+from typing import List
+import pytest
+
+
+@pytest.fixture
+def client(app):
+    app.register_blueprint(api, url_prefix="/api")
+    GameValues.create("game1", "cat1", None, wr_time=60, wr_points=10, mean_time=90, run_id="run1")
+    GameValues.create("game1", "cat2", None, wr_time=600, wr_points=20, mean_time=900, run_id="run2")
+    GameValues.create("game2", "cat3", None, wr_time=60, wr_points=30, mean_time=120, run_id="run3")
+    GameValues.create("game3", "cat4", None, wr_time=60, wr_points=40, mean_time=60, run_id="run4")
+    return app.test_client()
+
+
+def __get_run_ids(client, query_string: str) -> List[str]:
+    response = client.get(f"/api/game-values?{query_string}")
+    assert response.status_code == 200
+    return [game_value["runId"] for game_value in response.get_json()["data"]]
+
+
+def test_search_matches_any_of_the_games_or_categories(client):
+    assert __get_run_ids(client, "game=game1&category=cat4") == ["run4", "run2", "run1"]
+
+
+def test_filters_by_mean_time(client):
+    assert __get_run_ids(client, "minMeanTime=100&maxMeanTime=900") == ["run3", "run2"]
+
+
+def test_pages_follow_each_other(client):
+    first_page = client.get("/api/game-values?limit=2&orderBy=wrTime&order=asc").get_json()
+    second_page = client.get(f"/api/game-values?limit=2&orderBy=wrTime&order=asc&after={first_page['next']}").get_json()
+
+    run_ids = [game_value["runId"] for game_value in first_page["data"] + second_page["data"]]
+    assert run_ids == ["run1", "run3", "run4", "run2"]
@@ -0,0 +1,32 @@
+from flask import Response
+from services.payload_cache import get_cached_payload_response
+from models.core_models import PayloadVersion
+import gzip
+
+
+def __get_response(app, **headers: str) -> Response:
+    with app.test_request_context(headers=headers):
+        return get_cached_payload_response(PayloadVersion.PLAYERS, lambda: [{"userId": "first"}])
+
+
+def test_each_encoding_has_its_own_etag(app):
+    gzip_response = __get_response(app, **{"Accept-Encoding": "gzip"})
+    identity_response = __get_response(app)
+
+    assert gzip_response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(gzip_response.get_data()) == identity_response.get_data()
+    assert gzip_response.get_etag() != identity_response.get_etag()
+
+
+def test_refused_encodings_are_not_sent(app):
+    response = __get_response(app, **{"Accept-Encoding": "gzip;q=0"})
+
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data() == b'[{"userId": "first"}]'
+
+
+def test_matching_etag_is_not_modified(app):
+    etag, _ = __get_response(app, **{"Accept-Encoding": "gzip"}).get_etag()
+
+    assert __get_response(app, **{"Accept-Encoding": "gzip", "If-None-Match": f'"{etag}"'}).status_code == 304
+    assert __get_response(app, **{"If-None-Match": f'"{etag}"'}).status_code == 200
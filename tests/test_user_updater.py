@@ -0,0 +1,20 @@
+from models.core_models import PayloadVersion, Player
+from services.utils import SpeedrunComError
+from unittest import mock
+import services.user_updater as user_updater
+
+
+def test_removing_a_player_missing_from_speedrun_com_updates_ranks_and_payload(app):
+    Player.create("first", "First", score=30)
+    Player.create("missing", "Missing", score=20)
+    Player.create("third", "Third", score=10)
+    version = PayloadVersion.get_version(PayloadVersion.PLAYERS)
+
+    not_found = SpeedrunComError({"error": "404 Not Found", "details": ""})
+    with mock.patch.object(user_updater, "set_user_code_and_name", side_effect=not_found):
+        result = user_updater.get_updated_user("missing")
+
+    assert result["state"] == "warning"
+    assert Player.get("missing") is None
+    assert Player.get("third").rank == 2
+    assert PayloadVersion.get_version(PayloadVersion.PLAYERS) > version